@@ -0,0 +1,320 @@
+"""Benchmarks for the pattern generators and the Tcode firing loop.
+
+Run from anywhere, results are printed as JSON (or written with --output):
+
+    python benchmarks/run_benchmarks.py --output bench.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from itertools import islice
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)  # configuration.py reads config.yaml from the working directory
+sys.path.insert(0, os.path.join(ROOT, "src"))
+
+import numpy as np  # noqa: E402
+
+import patterns as patterns_module  # noqa: E402
+import tcode_fire  # noqa: E402
+from bandwidth import BITS_PER_BYTE, LinkBudget  # noqa: E402
+from block_cache import BlockCache  # noqa: E402
+from hssp import Script  # noqa: E402
+from transports import CaptureTransport  # noqa: E402
+from producer import RENDER_HORIZON_MS, PatternProducer  # noqa: E402
+
+PARAMS = (100, 0, 20, 80, 140 / 1000)
+SPEEDS = (50, 100, 200, 400, 800)
+STROKE_RANGES = ((0, 100), (20, 80), (40, 60))
+SEED = 1234
+
+
+def all_patterns():
+    names = list(patterns_module.PATTERN_AXES)
+    names.append("costumed_stroke_half_twist_costumed_surge_smooth_motion_generator")
+    return {name: getattr(patterns_module, name) for name in names}
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]  # noqa: E731
+    return {
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": values[-1],
+        "mean": statistics.fmean(values),
+    }
+
+
+def bench_generator(pattern, lines):
+    random.seed(SEED)
+    generator = pattern(*PARAMS)
+    start = time.perf_counter()
+    for _ in islice(generator, lines):
+        pass
+    elapsed = time.perf_counter() - start
+    return lines / elapsed
+
+
+def bench_memory(pattern, lines):
+    """Memory that stays allocated per line while the lines are buffered."""
+    random.seed(SEED)
+    generator = pattern(*PARAMS)
+    next(generator)  # warm up, the first block is rendered here
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    kept = list(islice(generator, lines))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks_after = sys.getallocatedblocks()
+    del kept
+    return {
+        "blocks_per_line": (blocks_after - blocks_before) / lines,
+        "bytes_per_line": current / lines,
+        "peak_bytes_per_line": peak / lines,
+    }
+
+
+def bench_block(pattern, lines):
+    start = time.perf_counter()
+    block = patterns_module.render_pattern_block(pattern, *PARAMS, count=lines)
+    rendered = time.perf_counter()
+    encoded = block.to_tcode_block()
+    encoded_at = time.perf_counter()
+    return {
+        "render_lines_per_s": lines / (rendered - start),
+        "encode_lines_per_s": lines / (encoded_at - rendered),
+        "bytes_per_line": encoded.nbytes / lines,
+    }
+
+
+def bench_patterns(lines):
+    results = {}
+    for name, pattern in all_patterns().items():
+        result = {
+            "generator_lines_per_s": bench_generator(pattern, lines),
+            **bench_memory(pattern, lines),
+        }
+        if name in patterns_module.PATTERN_AXES:
+            result["block"] = bench_block(pattern, lines)
+        results[name] = result
+    return results
+
+
+def bench_render(repeat):
+    """Time to render the whole horizon that set_state used to fill up front."""
+    results = []
+    for speed in SPEEDS:
+        for bottom, top in STROKE_RANGES:
+            for name, pattern in all_patterns().items():
+                timings = []
+                for _ in range(repeat):
+                    random.seed(SEED)
+                    start = time.perf_counter()
+                    rendered_ms = 0
+                    for line in pattern(top, bottom, 20, 80, speed / 1000):
+                        rendered_ms += line.duration_ms
+                        if rendered_ms >= RENDER_HORIZON_MS:
+                            break
+                    timings.append((time.perf_counter() - start) * 1000)
+                results.append(
+                    {
+                        "pattern": name,
+                        "speed": speed,
+                        "bottom": bottom,
+                        "top": top,
+                        "render_ms": min(timings),
+                    }
+                )
+    return results
+
+
+def horizon_ms(pattern):
+    start = time.perf_counter()
+    rendered_ms = 0
+    for line in pattern(*PARAMS):
+        rendered_ms += line.duration_ms
+        if rendered_ms >= RENDER_HORIZON_MS:
+            break
+    return (time.perf_counter() - start) * 1000
+
+
+def bench_cache():
+    """Horizon render time with an empty block cache and with the blocks cached."""
+    results = {}
+    patterns_module.block_cache = BlockCache()
+    try:
+        for name in patterns_module.PATTERN_AXES:
+            pattern = getattr(patterns_module, name)
+            cold_ms = horizon_ms(pattern)
+            results[name] = {"cold_ms": cold_ms, "warm_ms": horizon_ms(pattern)}
+        results["stats"] = patterns_module.block_cache.stats()
+    finally:
+        patterns_module.block_cache = None
+    return results
+
+
+def bench_emission(seconds):
+    fire = tcode_fire.TcodeFire("bench", 115200, transport=CaptureTransport())
+    fire.start_thread()
+    producer = PatternProducer(fire)
+    producer.start()
+    producer.set_pattern(patterns_module.long_stroke_1(*PARAMS))
+    time.sleep(seconds)
+    producer.stop_thread()
+    fire.stop_thread()
+    fire.join()
+
+    writes = fire.transport.writes
+    # the first line waits INIT_TIME_DURATION_MS, the rest follow the step grid
+    intervals = [
+        (b[0] - a[0]) * 1000 for a, b in zip(writes[1:], writes[2:])
+    ]
+    errors = [abs(i - patterns_module.STEP_SIZE_MS) for i in intervals]
+    return {
+        "seconds": seconds,
+        "lines": len(writes),
+        "interval_ms": percentiles(intervals),
+        "interval_error_ms": percentiles(errors),
+        "scheduler": fire.jitter_stats(),
+    }
+
+
+def bench_seek(actions, seeks):
+    """Seeking an HSSP script: finding the action, and until TcodeFire wrote its first line."""
+    random.seed(SEED)
+    times = array("i")
+    at = 0
+    for _ in range(actions):
+        at += random.randint(50, 500)
+        times.append(at)
+    script = Script(times, array("B", (random.randint(0, 100) for _ in range(actions))))
+    written = threading.Event()
+    fire = tcode_fire.TcodeFire(
+        "bench",
+        115200,
+        on_first_write=lambda generation, fired_at: written.set(),
+        transport=CaptureTransport(),
+    )
+    fire.start_thread()
+    producer = PatternProducer(fire)
+    producer.start()
+    index_us, refill_ms = [], []
+    for _ in range(seeks):
+        at_ms = random.randrange(script.duration_ms)
+        start = time.perf_counter()
+        script.index_at(at_ms)
+        index_us.append((time.perf_counter() - start) * 1e6)
+        written.clear()
+        start = time.perf_counter()
+        producer.set_pattern(script.lines(at_ms), horizon_ms=float("inf"))
+        written.wait()
+        refill_ms.append((time.perf_counter() - start) * 1000)
+    producer.stop_thread()
+    fire.stop_thread()
+    fire.join()
+    return {
+        "actions": actions,
+        "index_us": percentiles(index_us),
+        "refill_ms": percentiles(refill_ms),
+    }
+
+
+def link_lag_ms(writes, bytes_per_s):
+    """How late each write reaches the device behind the ones before it, per the link's rate."""
+    lags = []
+    fill, last = 0.0, None
+    for at, data in writes:
+        if last is not None:
+            fill = max(0.0, fill - (at - last) * bytes_per_s)
+        fill += len(data)
+        last = at
+        lags.append(fill / bytes_per_s * 1000)
+    return lags
+
+
+def bench_link(seconds, baudrate=115200, step_ms=2):
+    """Five axes every `step_ms`, more than the link carries, with and without a budget."""
+    axes = ("L0", "L1", "L2", "R1", "R2")
+    results = {}
+    for name, budget in (("unbudgeted", None), ("budgeted", LinkBudget(baudrate, name="bench"))):
+        fire = tcode_fire.TcodeFire(
+            "bench", baudrate, transport=CaptureTransport(), link_budget=budget
+        )
+        fire.start_thread()
+        stop = threading.Event()
+
+        def push():
+            position = 0
+            while not stop.is_set():
+                position = (position + 7) % 100
+                line = tcode_fire.TcodeLine(
+                    [tcode_fire.TcodeInstruction(axis, position, step_ms) for axis in axes]
+                )
+                fire.push_instruction(line)
+
+        pusher = threading.Thread(target=push, daemon=True)
+        pusher.start()
+        time.sleep(seconds)
+        stop.set()
+        fire.stop_thread()
+        fire.join()
+
+        writes = fire.transport.writes
+        sent = sum(len(data) for _, data in writes)
+        results[name] = {
+            "lines": fire.write_stats()["lines"],
+            "writes": len(writes),
+            "bytes_per_s": sent / seconds,
+            "lag_ms": percentiles(link_lag_ms(writes, baudrate / BITS_PER_BYTE)),
+            "link": budget.stats() if budget is not None else None,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--emission-seconds", type=float, default=5)
+    parser.add_argument("--script-actions", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+        },
+        "patterns": bench_patterns(args.lines),
+        "render": bench_render(args.repeat),
+        "cache": bench_cache(),
+        "emission": bench_emission(args.emission_seconds),
+        "seek": bench_seek(args.script_actions, 200),
+        "link": bench_link(args.emission_seconds),
+    }
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
 from fastapi.staticfiles import StaticFiles
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 
+from src.configuration import configuration
+from src.metrics import read_metrics
+from src.pac import pac_script
+
 
 app = FastAPI()
 app.mount("/resources", StaticFiles(directory="resources"), name="resources")
@@ -21,4 +25,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-)
\ No newline at end of file
+)
+
+
+@app.get("/metrics")
+def metrics():
+    """Latest latency histograms written by the MITM proxy."""
+    return read_metrics(configuration.get("metrics", {}).get("path", "metrics.json"))
+
+
+@app.get("/proxy.pac")
+def proxy_pac():
+    """PAC file pointing the browser at the configured proxy."""
+    server = configuration.get("server", {})
+    return Response(
+        pac_script(server.get("host", "127.0.0.1"), server.get("port", 8080)),
+        media_type="application/x-ns-proxy-autoconfig",
+    )
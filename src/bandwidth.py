@@ -0,0 +1,92 @@
+"""How much a serial link carries, and how much of what was written is still on its way.
+
+At 115200 baud the link moves about 11.5 KB/s. Lines written faster than
+that wait in the USB stack and the device's receive buffer and play late.
+A LinkBudget tells TcodeFire when that is about to happen, which then
+plays fewer, longer moves instead (see `TcodeFire._fit_budget`).
+"""
+import time
+
+# 8N1, every byte comes with a start and a stop bit
+BITS_PER_BYTE = 10
+# no more than this many ms of lines may be on their way to the device
+LINK_BUDGET_MS = 20
+# over budget is reported at most this often
+WARN_INTERVAL_S = 10
+
+
+class LinkBudget:
+    """A leaky bucket of the bytes written, drained at the link's rate.
+
+    The bucket is the estimated fill of the device's receive buffer (and
+    everything in front of it), `fits` says whether one more write leaves
+    it within `budget_ms` of the link's time by the next write.
+    """
+
+    def __init__(self, baudrate, budget_ms=LINK_BUDGET_MS, name="") -> None:
+        self.bytes_per_s = baudrate / BITS_PER_BYTE
+        self.max_fill_bytes = self.bytes_per_s * budget_ms / 1000
+        self._name = name
+        self._fill = 0.0
+        self._updated_at = None
+        self._window_started_at = None
+        self._window_bytes = 0
+        self._warned_at = None
+        self.bytes_written = 0
+        self.recent_bytes_per_s = 0.0
+        self.peak_fill_bytes = 0.0
+        # lines played as part of a longer move, and writes over budget all the same
+        self.merged_lines = 0
+        self.over_budget = 0
+
+    def fill_at(self, now) -> float:
+        """Bytes still on their way at `now`."""
+        if self._updated_at is None:
+            return 0.0
+        return max(0.0, self._fill - (now - self._updated_at) * self.bytes_per_s)
+
+    def fits(self, nbytes, interval_s, now) -> bool:
+        """True if writing `nbytes` now leaves the link within budget `interval_s` later."""
+        left = self.fill_at(now) + nbytes - interval_s * self.bytes_per_s
+        return left <= self.max_fill_bytes
+
+    def merged(self, lines=1):
+        self.merged_lines += lines
+        now = time.perf_counter()
+        if self._warned_at is None or now - self._warned_at > WARN_INTERVAL_S:
+            self._warned_at = now
+            print(
+                f"{self._name} is over its {self.bytes_per_s / 1000:.1f} KB/s, "
+                "merging lines into longer moves"
+            )
+
+    def written(self, nbytes, now):
+        fill = self.fill_at(now) + nbytes
+        if fill - nbytes > self.max_fill_bytes:
+            self.over_budget += 1
+        self._fill = fill
+        self._updated_at = now
+        self.peak_fill_bytes = max(self.peak_fill_bytes, fill)
+        self.bytes_written += nbytes
+        if self._window_started_at is None:
+            self._window_started_at = now
+        self._window_bytes += nbytes
+        if now - self._window_started_at >= 1:
+            self.recent_bytes_per_s = self._window_bytes / (now - self._window_started_at)
+            self._window_started_at = now
+            self._window_bytes = 0
+
+    def stats(self) -> dict:
+        now = time.perf_counter()
+        fill = self.fill_at(now)
+        return {
+            "capacity_bytes_per_s": self.bytes_per_s,
+            "bytes_per_s": self.recent_bytes_per_s,
+            "utilisation": self.recent_bytes_per_s / self.bytes_per_s,
+            "bytes_written": self.bytes_written,
+            "fill_bytes": fill,
+            "fill_ms": fill / self.bytes_per_s * 1000,
+            "peak_fill_bytes": self.peak_fill_bytes,
+            "merged_lines": self.merged_lines,
+            "over_budget": self.over_budget,
+        }
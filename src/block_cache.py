@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+BLOCK_CACHE_MAX_BYTES = 16 * 1024 * 1024
+# speeds are rendered in steps of this many mm/ms, i.e. 1 mm/s
+SPEED_QUANTUM = 0.001
+
+
+class BlockCache:
+    """Least recently used TcodeBlocks, bounded by their encoded size.
+
+    Keys are built by the caller, see `patterns.sample_axes`. Blocks are
+    shared between the streams that hit them and must not be changed.
+    """
+
+    def __init__(self, max_bytes=BLOCK_CACHE_MAX_BYTES, speed_quantum=SPEED_QUANTUM) -> None:
+        self._max_bytes = max_bytes
+        self._speed_quantum = speed_quantum
+        self._blocks = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def quantize(self, parameters) -> tuple:
+        """Rounds (top, bottom, back, forth, speed) so that close states share blocks."""
+        *positions, speed = parameters
+        speed = round(speed / self._speed_quantum) * self._speed_quantum
+        return tuple(int(round(p)) for p in positions) + (round(speed, 6),)
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        with self._lock:
+            if block.nbytes > self._max_bytes:
+                return
+            previous = self._blocks.pop(key, None)
+            if previous is not None:
+                self._nbytes -= previous.nbytes
+            self._blocks[key] = block
+            self._nbytes += block.nbytes
+            while self._nbytes > self._max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "blocks": len(self._blocks),
+                "bytes": self._nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
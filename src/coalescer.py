@@ -0,0 +1,80 @@
+import threading
+import time
+
+# updates closer together than this are merged into one
+COALESCE_WINDOW_MS = 50
+
+
+class Coalescer(threading.Thread):
+    """Merges bursts of state updates into one `apply(keys, context)` call.
+
+    An update after a quiet window is applied right away. The ones that
+    follow within `window_ms` are collected and applied together at the
+    end of the window, with the latest `context`. The state itself is
+    read by `apply`, so it always sees the latest values.
+    """
+
+    def __init__(self, apply, window_ms=COALESCE_WINDOW_MS) -> None:
+        super().__init__(daemon=True)
+        self._apply = apply
+        self._window_s = window_ms / 1000
+        self._keys = set()
+        self._context = None
+        self._applied_at = None
+        self._submitted = 0
+        self._applied = 0
+        self._condition = threading.Condition()
+        self._mode = "running"
+
+    def submit(self, key, context=None):
+        with self._condition:
+            self._add(key, context)
+            now = time.perf_counter()
+            if self._applied_at is None or now - self._applied_at >= self._window_s:
+                self._apply_pending(now)
+            else:
+                self._condition.notify()
+
+    def apply_now(self, key, context=None):
+        """Applies `key` together with anything pending, without waiting."""
+        with self._condition:
+            self._add(key, context)
+            self._apply_pending(time.perf_counter())
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self._submitted,
+            "applied": self._applied,
+            "saved": self._submitted - self._applied,
+        }
+
+    def stop_thread(self):
+        with self._condition:
+            self._mode = "stop"
+            self._condition.notify()
+
+    def _add(self, key, context):
+        self._submitted += 1
+        self._keys.add(key)
+        self._context = context
+
+    def _apply_pending(self, now):
+        keys, self._keys = self._keys, set()
+        self._applied_at = now
+        self._applied += 1
+        self._apply(keys, self._context)
+
+    def run(self) -> None:
+        with self._condition:
+            while self._mode == "running":
+                if not self._keys:
+                    self._condition.wait()
+                    continue
+                remaining_s = self._applied_at + self._window_s - time.perf_counter()
+                if remaining_s > 0:
+                    self._condition.wait(remaining_s)
+                    continue
+                try:
+                    self._apply_pending(time.perf_counter())
+                except Exception as e:
+                    print("state update failed -", e)
@@ -0,0 +1,58 @@
+class DeviceGroup:
+    """Several TcodeFires playing one stream, in place of a single TcodeFire.
+
+    Every line is rendered once and pushed to each device, which maps it
+    into its own ranges (see `encoding.RangeMap`) on its own thread. All
+    devices get the same clears and flushes, so their generations stay
+    the same and the first device's answer stands for the group.
+    """
+
+    def __init__(self, devices: dict) -> None:
+        """`devices` maps a port name to the TcodeFire writing to it."""
+        self.devices = devices
+        self._fires = list(devices.values())
+
+    def push_instruction(self, instruction, generation=None) -> bool:
+        pushed = True
+        for fire in self._fires:
+            # blocks on the fullest queue, the devices share one timeline anyway
+            pushed = fire.push_instruction(instruction, generation) and pushed
+        return pushed
+
+    def push_instructions(self, *instruction):
+        for i in instruction:
+            self.push_instruction(i)
+
+    @property
+    def rate(self):
+        return self._fires[0].rate
+
+    @property
+    def lead_ms(self):
+        """The lead of the slowest device, scripts seek ahead by it."""
+        return max(fire.lead_ms for fire in self._fires)
+
+    def set_rate(self, rate):
+        for fire in self._fires:
+            fire.set_rate(rate)
+
+    def clear(self) -> int:
+        return [fire.clear() for fire in self._fires][0]
+
+    def flush(self) -> tuple:
+        return [fire.flush() for fire in self._fires][0]
+
+    def start_thread(self):
+        for fire in self._fires:
+            fire.start_thread()
+
+    def stop_thread(self):
+        for fire in self._fires:
+            fire.stop_thread()
+
+    def join(self, timeout=None):
+        for fire in self._fires:
+            fire.join(timeout)
+
+    def __len__(self):
+        return max(len(fire) for fire in self._fires)
@@ -0,0 +1,116 @@
+import numpy as np
+
+from tcode_fire import TcodeInstruction, TcodeLine
+
+# config range name -> Tcode axis
+AXES = {
+    "stroke": "L0",
+    "surge": "L1",
+    "sway": "L2",
+    "twist": "R0",
+    "roll": "R1",
+    "pitch": "R2",
+    "valve": "A0",
+}
+# axis positions are sent as two digits
+POSITIONS = 100
+
+
+def configured_axes(ranges) -> set:
+    """Axes that have a range in the config and are not switched off with `enabled: false`."""
+    return {
+        AXES[name]
+        for name, axis_range in ranges.items()
+        if name in AXES and axis_range.get("enabled", True)
+    }
+
+
+def merge_ranges(ranges, overrides) -> dict:
+    """`ranges` with a device's `overrides` merged in axis by axis, fields left out are kept."""
+    merged = {name: dict(axis_range) for name, axis_range in ranges.items()}
+    for name, axis_range in (overrides or {}).items():
+        merged[name] = {**merged.get(name, {}), **axis_range}
+    return merged
+
+
+class DeltaEncoder:
+    """Drops axis commands that would not change what the device does.
+
+    Keeps the last target and end time sent on each axis. A command for
+    the same target is skipped when the axis already gets there by the
+    time the new command asks for, and axes outside `axes` are never sent.
+
+    Works on the encoded line, so lines from a TcodeBlock are never
+    parsed into instructions on the firing thread.
+    """
+
+    def __init__(self, axes=None) -> None:
+        self._axes = None if axes is None else {axis.encode() for axis in axes}
+        self.dropped = 0
+        self.reset()
+
+    def reset(self):
+        """Forgets what was sent, the next line goes out in full."""
+        self._targets = {}
+        self._now_ms = 0
+
+    def encode(self, line: TcodeLine) -> bytes:
+        encoded = line.encode()
+        commands = encoded.split()
+        kept = []
+        for command in commands:
+            axis = command[:2]
+            if self._axes is not None and axis not in self._axes:
+                continue
+            # positions are always written the same way, the digits compare as they are
+            target, _, duration_ms = command[2:].partition(b"I")
+            end_ms = self._now_ms + int(duration_ms or 0)
+            last = self._targets.get(axis)
+            if last is not None and last[0] == target and last[1] <= end_ms:
+                continue
+            self._targets[axis] = (target, end_ms)
+            kept.append(command)
+        self._now_ms += line.duration_ms
+        self.dropped += len(commands) - len(kept)
+        if len(kept) == len(commands):
+            return encoded
+        if not kept:
+            return b""
+        return b" ".join(kept) + b"\n"
+
+
+class RangeMap:
+    """Moves lines rendered for one set of `ranges` into a device's own ranges.
+
+    Each axis whose range differs gets a table from rendered to device
+    position, built for all positions at once, so a line is remapped with
+    one lookup per command.
+    """
+
+    def __init__(self, source_ranges, target_ranges) -> None:
+        positions = np.arange(POSITIONS)
+        self._tables = {}
+        for name, axis in AXES.items():
+            source, target = source_ranges.get(name), target_ranges.get(name)
+            # an axis without both ends of its range is left as it was rendered
+            if any(r is None or "min" not in r or "max" not in r for r in (source, target)):
+                continue
+            if (source["min"], source["max"]) == (target["min"], target["max"]):
+                continue
+            table = np.interp(
+                positions, [source["min"], source["max"]], [target["min"], target["max"]]
+            )
+            # lists index faster than arrays one value at a time
+            self._tables[axis] = np.rint(table).astype(int).tolist()
+
+    def remap(self, line: TcodeLine) -> TcodeLine:
+        if not self._tables:
+            return line
+        instructions = []
+        for instruction in line.instructions:
+            table = self._tables.get(instruction.axis)
+            if table is not None:
+                value = table[min(max(instruction.value, 0), POSITIONS - 1)]
+                instruction = TcodeInstruction(instruction.axis, value, instruction.duration_ms)
+            instructions.append(instruction)
+        return TcodeLine(instructions, line.duration_ms)
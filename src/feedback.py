@@ -0,0 +1,179 @@
+"""What the device says back, read off its transport without holding up the writes.
+
+TCode firmware answers `D0` with its name, `D1` with the TCode version
+and `D2` with a `L0 0 9999 Up` line per axis. Some firmware also reports
+positions (`L05000 R09999`) or acknowledges commands with `ok`.
+
+A `D1` sent every now and then between lines times the round trip
+through the USB stack and the firmware. Half of it is how long a line
+takes to reach the device, which TcodeFire sends its lines ahead by.
+"""
+import re
+import threading
+import time
+from collections import deque
+
+IDENTIFY = b"D0\nD1\nD2\n"
+PROBE = b"D1\n"
+PROBE_INTERVAL_S = 1.0
+# a probe not answered by then is given up on
+PROBE_TIMEOUT_S = 1.0
+# weight of a new round trip in the smoothed one
+RTT_SMOOTHING = 0.2
+# never send lines further ahead than this, whatever the round trips say
+MAX_LEAD_MS = 50
+
+VERSION = re.compile(r"tcode\s*v?\d", re.IGNORECASE)
+AXIS = re.compile(r"([LRVA]\d)\s+(-?\d+)\s+(-?\d+)\s*(.*)")
+POSITION = re.compile(r"([LRVA]\d)(\d+)")
+ACK = re.compile(r"ok\b", re.IGNORECASE)
+
+
+class DeviceFeedback:
+    """Parses one device's answers and keeps its round trip time.
+
+    `receive` runs on the transport's reader thread, `probe` on
+    TcodeFire's thread right after a line went out.
+    """
+
+    def __init__(self, probe_interval_s=PROBE_INTERVAL_S, max_lead_ms=MAX_LEAD_MS) -> None:
+        self._probe_interval_s = probe_interval_s
+        self._max_lead_ms = max_lead_ms
+        self._transport = None
+        self._lock = threading.Lock()
+        # the identification queries not answered yet, in the order they were sent
+        self._expecting = deque()
+        self._probe_sent_at = None
+        # None until the transport connected, probes wait for the identification
+        self._last_probe_at = None
+        self.device = None
+        self.version = None
+        self.axes = {}
+        # the last reported position per axis, 0-100
+        self.positions = {}
+        self.acks = 0
+        self.other = 0
+        self.last_message = None
+        self.rtt_ms = None
+        self.min_rtt_ms = None
+        self.smoothed_rtt_ms = None
+        self.probes = 0
+        self.lost_probes = 0
+
+    def attach(self, transport) -> bool:
+        """Probes through `transport` if it reads for us, returns False if it does not."""
+        if transport.on_line != self.receive:
+            return False
+        self._transport = transport
+        return True
+
+    def identify(self, transport):
+        """Asks the device what it is, the transport calls this on every (re)connect."""
+        with self._lock:
+            self._expecting.clear()
+            self._expecting.extend(("D0", "D1", "D2"))
+            # a probe from before the reconnect is never answered, and the
+            # identification makes a poor first one
+            self._probe_sent_at = None
+            self._last_probe_at = time.perf_counter()
+        transport.write(IDENTIFY)
+
+    @property
+    def lead_ms(self):
+        """How long a line takes to reach the device, half the smoothed round trip."""
+        if self.smoothed_rtt_ms is None:
+            return 0
+        return min(self.smoothed_rtt_ms / 2, self._max_lead_ms)
+
+    def probe(self, now):
+        """Sends a D1 if the last one was answered (or given up on) and one is due."""
+        if self._transport is None:
+            return
+        with self._lock:
+            if self._last_probe_at is None:
+                return
+            if self._probe_sent_at is not None:
+                if now - self._probe_sent_at < PROBE_TIMEOUT_S:
+                    return
+                self._probe_sent_at = None
+                self.lost_probes += 1
+            if now - self._last_probe_at < self._probe_interval_s:
+                return
+            self._last_probe_at = now
+            self._probe_sent_at = time.perf_counter()
+            self.probes += 1
+        self._transport.write(PROBE)
+
+    def receive(self, line: bytes, received_at):
+        text = line.decode("utf-8", "replace").strip()
+        with self._lock:
+            if VERSION.match(text):
+                self.version = text
+                self._answered("D1")
+                if self._probe_sent_at is not None:
+                    self._add_rtt((received_at - self._probe_sent_at) * 1000)
+                    self._probe_sent_at = None
+                return
+            axis = AXIS.fullmatch(text)
+            if axis is not None:
+                self._answered("D2")
+                self.axes[axis[1]] = {
+                    "min": int(axis[2]),
+                    "max": int(axis[3]),
+                    "name": axis[4],
+                }
+                return
+            if ACK.match(text):
+                self.acks += 1
+                return
+            tokens = text.split()
+            positions = [POSITION.fullmatch(token) for token in tokens]
+            if tokens and all(positions):
+                for position in positions:
+                    digits = position[2]
+                    self.positions[position[1]] = int(digits) * 100 / 10 ** len(digits)
+                return
+            if self._expecting and self._expecting[0] == "D0":
+                self._expecting.popleft()
+                self.device = text
+                return
+            self.other += 1
+            self.last_message = text
+
+    def _answered(self, query):
+        # a query that went unanswered is not waited for any longer
+        if query in self._expecting:
+            while self._expecting.popleft() != query:
+                pass
+
+    def _add_rtt(self, rtt_ms):
+        self.rtt_ms = rtt_ms
+        self.min_rtt_ms = rtt_ms if self.min_rtt_ms is None else min(self.min_rtt_ms, rtt_ms)
+        if self.smoothed_rtt_ms is None:
+            self.smoothed_rtt_ms = rtt_ms
+        else:
+            self.smoothed_rtt_ms += RTT_SMOOTHING * (rtt_ms - self.smoothed_rtt_ms)
+
+    def stats(self) -> dict:
+        # the reader thread adds to axes and positions meanwhile
+        with self._lock:
+            return self._stats()
+
+    def _stats(self) -> dict:
+        return {
+            "device": self.device,
+            "version": self.version,
+            "axes": sorted(self.axes),
+            "rtt_ms": {
+                "last": self.rtt_ms,
+                "min": self.min_rtt_ms,
+                "smoothed": self.smoothed_rtt_ms,
+            },
+            "lead_ms": self.lead_ms,
+            "probes": self.probes,
+            "lost_probes": self.lost_probes,
+            "acks": self.acks,
+            "positions": dict(self.positions),
+            "other": self.other,
+            "last_message": self.last_message,
+        }
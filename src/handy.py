@@ -0,0 +1,470 @@
+"""The emulated Handy: its state, the API handlers and the device behind them.
+
+Importing this starts the device threads. The requests come in through
+the mitmproxy addon in main.py or the standalone handy_server.py, and
+are routed to their handlers by handy_api.py.
+
+Every connection key listed under `sessions` in config.yaml gets a
+HandySession of its own, with its own devices. Any other key, or none,
+plays on the default session.
+"""
+import json
+import math
+import random
+import threading
+import time
+from functools import partial
+
+import patterns as patterns_module
+from bandwidth import LinkBudget
+from block_cache import BlockCache
+from coalescer import COALESCE_WINDOW_MS, Coalescer
+from configuration import configuration
+from device_group import DeviceGroup
+from encoding import DeltaEncoder, RangeMap, configured_axes, merge_ranges
+from feedback import DeviceFeedback
+from handy_api import ACTIONS, HandyRequest, dispatch, server_time_ms
+from hssp import ScriptCache
+from metrics import LatencyMetrics, MetricsWriter
+from producer import PatternProducer
+from tcode_fire import TcodeFire
+from warmup import WARMUP_BLOCKS, Warmup
+
+
+HEADERS = {
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "*",
+    "Access-Control-Allow-Headers": "*",
+    "Access-Control-Max-Age": "600",
+}
+# the header the Handy API is called with, as the front ends see it lowercased
+CONNECTION_KEY_HEADER = "x-connection-key"
+# a synctime further off than this seeks the script to where the video is
+SYNC_TOLERANCE_MS = 50
+
+
+print("welcum to stroker proxy :)")
+metrics = LatencyMetrics()
+com = configuration["COM"]
+
+
+def device_fire(port, baudrate, ranges=None, session="default") -> TcodeFire:
+    """A TcodeFire for one device of `session`, `ranges` override config.yaml's per axis."""
+    device_ranges = merge_ranges(configuration["ranges"], ranges)
+    delta_encoder = None
+    if com.get("delta_encoding"):
+        delta_encoder = DeltaEncoder(configured_axes(device_ranges))
+    link_budget = None
+    # network transports have no baudrate to keep to
+    if com.get("link_budget_ms") and "://" not in port:
+        link_budget = LinkBudget(baudrate, com["link_budget_ms"], name=port)
+    return TcodeFire(
+        port,
+        baudrate,
+        write_ahead_ms=com.get("write_ahead_ms", 0),
+        delta_encoder=delta_encoder,
+        range_map=RangeMap(configuration["ranges"], device_ranges) if ranges else None,
+        on_first_write=partial(metrics.first_write, session),
+        feedback=DeviceFeedback() if com.get("feedback") else None,
+        link_budget=link_budget,
+    )
+
+
+def device_target(devices, session="default") -> tuple:
+    """What a session plays on for a `devices` list, and its TcodeFires by port.
+
+    The patterns are rendered once, a device group hands every line to each device.
+    """
+    fires = {
+        device["port"]: device_fire(
+            device["port"],
+            device.get("baudrate", com["baudrate"]),
+            device.get("ranges"),
+            session,
+        )
+        for device in devices
+    }
+    if len(fires) == 1:
+        return next(iter(fires.values())), fires
+    return DeviceGroup(fires), fires
+
+
+keyframes = configuration.get("keyframes", {})
+cache_config = configuration.get("block_cache", {})
+if cache_config.get("enabled"):
+    patterns_module.block_cache = BlockCache(int(cache_config.get("max_mb", 16) * 1024 * 1024))
+
+SELECTIVE_PATTERNS = []
+for name, flag in configuration["patterns"].items():
+    if flag:
+        print("selected - ", name)
+        SELECTIVE_PATTERNS.append(getattr(patterns_module, name))
+playback_rate = configuration.get("playback_rate", {})
+warmup_config = configuration.get("warmup", {})
+hssp_config = configuration.get("hssp", {})
+script_cache = ScriptCache(hssp_config.get("cache_dir", ".hssp_cache"))
+
+
+def response_content(device_state: int) -> bytes:
+    """The status reply as bytes, with `%d` left for serverTime and servertime."""
+    response = {
+        "success": True,
+        "connected": True,
+        "result": 0,
+        "state": device_state,
+        "fwVersion": "3.2.3-a28b8bb",
+        "fwStatus": 0,
+        "hwVersion": 1,
+    }
+    return (json.dumps(response)[:-1] + ', "serverTime": %d, "servertime": %d}').encode()
+
+
+RESPONSES = {"halting": response_content(1), "running": response_content(2)}
+SERVER_TIME_CONTENT = b'{"serverTime": %d}'
+SERVER_TIME_ACTIONS = ("servertime", "getServerTime")
+
+def reply_content(action: str, session=None) -> bytes:
+    """The reply body for `action`, call it right before sending for an accurate time."""
+    if action in SERVER_TIME_ACTIONS:
+        return SERVER_TIME_CONTENT % server_time_ms()
+    return (session or default_session).status_content()
+
+
+def choose_pattern(top, bottom, speed, variation=None):
+    """Picks a pattern for a state, returns it with its arguments and a seed.
+
+    Without a `variation` the pick is random, with one it is the same
+    every time, which is what lets cached blocks be reused.
+    """
+    rng = random
+    if variation is not None:
+        rng = random.Random(f"{top}/{bottom}/{speed}/{variation}")
+    back = rng.randint(0, 50)
+    forth = rng.randint(50, 100)
+    seed = rng.getrandbits(32)
+    pattern = rng.choice(
+        SELECTIVE_PATTERNS
+        + [patterns_module.costumed_stroke_half_twist_costumed_surge_smooth_motion_generator]
+    )
+    return pattern, (top, bottom, back, forth, speed / 1000), seed
+
+
+def render_speed_for(speed):
+    """A warmed-up speed the playback rate can stretch to `speed`, else `speed`."""
+    speeds = warmup_config.get("speeds", [])
+    if not warmup_config.get("enabled") or not playback_rate.get("enabled") or not speeds:
+        return speed
+    nearest = min(speeds, key=lambda s: abs(s - speed))
+    if abs(nearest / speed - 1) <= warmup_config.get("snap", 0.1):
+        return nearest
+    return speed
+
+
+def warmup_tasks():
+    tasks = []
+    for speed in warmup_config.get("speeds", []):
+        for bottom, top in warmup_config.get("strokes", [[0, 100]]):
+            for variation in range(cache_config.get("variations", 4)):
+                pattern, arguments, _ = choose_pattern(top, bottom, speed, variation)
+                task = (pattern.__name__, patterns_module.block_cache.quantize(arguments))
+                if pattern.__name__ in patterns_module.PATTERN_AXES and task not in tasks:
+                    tasks.append(task)
+    return tasks
+
+
+class HandySession:
+    """One emulated Handy: its state, the pattern it plays and the devices playing it."""
+
+    def __init__(self, name, target, fires) -> None:
+        self.name = name
+        self.state = {
+            "stroke": {
+                "bottom": 0,
+                "top": 100,
+            },
+            "speed": 0,
+            "mode": "halting",
+            "direction": "up",
+        }
+        # the speed the running pattern was rendered at, TcodeFire's rate covers the rest
+        self.rendered_speed = None
+        # the HSSP script from the last setup, and the last play call: the script time
+        # it started at, the serverTime that was, and the request behind it
+        self.hssp = {"url": None, "script": None, "play": None}
+        self.hssp_lock = threading.Lock()
+        # while a script plays, stroke changes rescale it and speed changes are ignored
+        self.script_playing = False
+        self.t1 = target
+        self.fires = fires
+        self.producer = PatternProducer(
+            target,
+            keyframe_tolerance=keyframes["tolerance"] if keyframes.get("enabled") else None,
+        )
+        self.coalescer = Coalescer(
+            self.apply_state,
+            configuration.get("coalesce", {}).get("window_ms", COALESCE_WINDOW_MS),
+        )
+
+    def start(self):
+        self.t1.start_thread()
+        self.producer.start()
+        self.coalescer.start()
+
+    def stats(self) -> dict:
+        return {
+            "devices": {
+                port: {
+                    "jitter": fire.jitter_stats(),
+                    "writes": fire.write_stats(),
+                    "rate": fire.rate,
+                    "backlog": len(fire),
+                    "feedback": fire.feedback_stats(),
+                }
+                for port, fire in self.fires.items()
+            },
+            "state_updates": self.coalescer.stats(),
+        }
+
+    def status_content(self) -> bytes:
+        """The reply to most calls, the device state with serverTime spliced in."""
+        server_time = server_time_ms()
+        return RESPONSES.get(self.state["mode"], RESPONSES["running"]) % (
+            server_time,
+            server_time,
+        )
+
+    def rate_for(self, speed):
+        """The playback rate that plays the running pattern at `speed`, None if out of bounds."""
+        if not playback_rate.get("enabled") or not self.rendered_speed:
+            return None
+        rate = speed / self.rendered_speed
+        if playback_rate.get("min", 0.5) <= rate <= playback_rate.get("max", 2.0):
+            return rate
+        return None
+
+    def set_state(self, key: str, value) -> None:
+        """Sets the state for stroke, speed, or mode, the device follows via `coalescer`."""
+        state = self.state
+        if key == "stroke":
+            pass
+        elif key == "mode" and value == 0:
+            state["speed"] = 0
+
+        else:
+            state[key] = value
+        context = (metrics.action, metrics.received_at)
+        # starting and stopping never wait for a burst to settle
+        if key == "mode" or state["speed"] == 0:
+            self.coalescer.apply_now(key, context)
+        else:
+            self.coalescer.submit(key, context)
+
+    def apply_state(self, keys, context) -> None:
+        """Brings the device in line with `state` after the `keys` changed."""
+        action, received_at = context
+        self.print_state()
+        producer = self.producer
+        generation = producer.generation
+        self.update_pattern(keys, action, time.perf_counter())
+        if producer.generation != generation:
+            metrics.expect_first_write(
+                self.name, producer.generation, action, received_at, time.perf_counter()
+            )
+
+    def update_pattern(self, keys, action, started_at) -> None:
+        """Re-times, retargets or replaces the running pattern to match `state`."""
+        state, producer = self.state, self.producer
+        if self.script_playing and producer.playing and keys <= {"speed", "stroke"}:
+            if "stroke" in keys and producer.retarget(
+                top=state["stroke"]["top"], bottom=state["stroke"]["bottom"]
+            ):
+                metrics.span(action, "retarget", started_at)
+            return
+        self.script_playing = False
+        pattern = None
+        if (
+            state["mode"] == "running"
+            and state["speed"] != 0
+            and state["stroke"]["top"] != state["stroke"]["bottom"]
+        ):
+            bottom = int(state["stroke"]["bottom"])
+            top = int(state["stroke"]["top"])
+            # a tempo change only changes how fast the queued lines are played
+            rate = self.rate_for(state["speed"]) if keys == {"speed"} else None
+            if rate is not None and producer.playing:
+                self.t1.set_rate(rate)
+                metrics.span(action, "rate", started_at)
+                return
+            # speed and stroke changes bend the running pattern instead of restarting it
+            if keys <= {"speed", "stroke"} and producer.retarget(
+                top=top, bottom=bottom, speed=state["speed"] / 1000
+            ):
+                self.rendered_speed = state["speed"]
+                metrics.span(action, "retarget", started_at)
+                return
+            variation = None
+            if patterns_module.block_cache is not None:
+                # a state comes in a few variations, so going back to it hits the cache
+                variation = random.randrange(cache_config.get("variations", 4))
+            speed = render_speed_for(state["speed"])
+            pattern, arguments, seed = choose_pattern(top, bottom, speed, variation)
+            if pattern is patterns_module.costumed_stroke_half_twist_costumed_surge_smooth_motion_generator:
+                pattern = pattern(*arguments, seed=seed)
+            else:
+                pattern = pattern(*arguments)
+            print(f"current pattern = {pattern.__name__}")
+        self.rendered_speed = speed if pattern is not None else None
+        now = metrics.span(action, "render", started_at)
+        # the producer thread renders the pattern lazily, so the response goes out right away
+        producer.set_pattern(pattern)
+        if pattern is not None and speed != state["speed"]:
+            self.t1.set_rate(state["speed"] / speed)
+        metrics.span(action, "clear", now)
+
+    def print_state(self) -> None:
+        stroke_range = self.state["stroke"]
+        prefix = "" if self is default_session else f"[{self.name}] "
+        print(
+            f"{prefix}Current State -> Stroke: {stroke_range['bottom']} - {stroke_range['top']}, Speed: {self.state['speed']}, Mode: {self.state['mode']}"
+        )
+
+    def setup_script(self, url, sha256=None) -> None:
+        """Loads the script at `url` in the background, `play_from` starts it."""
+        with self.hssp_lock:
+            self.hssp.update(url=url, script=None, play=None)
+        threading.Thread(target=self.load_script, args=(url, sha256), daemon=True).start()
+
+    def load_script(self, url, sha256) -> None:
+        started_at = time.perf_counter()
+        try:
+            script = script_cache.load(url, sha256)
+        except Exception as e:
+            print("script failed -", e)
+            return
+        print(
+            f"loaded script - {len(script)} actions, {script.duration_ms / 1000:.0f}s, "
+            f"in {(time.perf_counter() - started_at) * 1000:.0f}ms"
+        )
+        with self.hssp_lock:
+            if self.hssp["url"] != url:  # set up another one meanwhile
+                return
+            self.hssp["script"] = script
+            play = self.hssp["play"]
+        if play is not None:
+            self.play_script(script, *play)
+
+    def play_from(self, start_ms, started_server_ms) -> None:
+        play = (start_ms, started_server_ms, metrics.action, metrics.received_at)
+        with self.hssp_lock:
+            script = self.hssp["script"]
+            self.hssp["play"] = play
+        if script is None:
+            print("play before the script loaded, starting once it has")
+            return
+        self.play_script(script, *play)
+
+    def sync_time(self, current_ms, server_time) -> None:
+        """Seeks the playing script if it drifted from the video's `current_ms`."""
+        with self.hssp_lock:
+            script, play = self.hssp["script"], self.hssp["play"]
+        if script is None or play is None:
+            return
+        start_ms, started_server_ms, _, _ = play
+        drift_ms = start_ms + server_time - started_server_ms - current_ms
+        if abs(drift_ms) <= SYNC_TOLERANCE_MS:
+            return
+        print(f"script drifted {drift_ms}ms, seeking")
+        play = (current_ms, server_time, metrics.action, metrics.received_at)
+        with self.hssp_lock:
+            self.hssp["play"] = play
+        self.play_script(script, *play)
+
+    def play_script(self, script, start_ms, started_server_ms, action, received_at) -> None:
+        """Plays `script` from where it is by now if it started at `start_ms` at `started_server_ms`."""
+        stroke = self.state["stroke"]
+        # the first line reaches the device `lead_ms` from now, it starts the script there
+        at_ms = start_ms + server_time_ms() - started_server_ms + round(self.t1.lead_ms)
+        generation = self.producer.set_pattern(
+            script.lines(at_ms, stroke["bottom"], stroke["top"]), horizon_ms=math.inf
+        )
+        self.script_playing = True
+        metrics.expect_first_write(
+            self.name, generation, action, received_at, time.perf_counter()
+        )
+
+    def stop_script(self) -> None:
+        with self.hssp_lock:
+            self.hssp["play"] = None
+        self.script_playing = False
+        self.producer.set_pattern(None)
+
+
+default_session = HandySession(
+    "default", *device_target(configuration.get("devices") or [com], "default")
+)
+# connection key -> its session, every request looks its session up here
+sessions = {
+    str(key): HandySession(str(key), *device_target(devices, str(key)))
+    for key, devices in (configuration.get("sessions") or {}).items()
+}
+for session in [default_session, *sessions.values()]:
+    if len(session.fires) > 1 or session is not default_session:
+        print(f"session {session.name} plays on", ", ".join(session.fires))
+    session.start()
+
+metrics_config = configuration.get("metrics", {})
+if metrics_config.get("enabled"):
+    MetricsWriter(
+        metrics,
+        metrics_config.get("path", "metrics.json"),
+        metrics_config.get("interval_s", 1),
+        extra=lambda: {
+            "sessions": {
+                session.name: session.stats()
+                for session in [default_session, *sessions.values()]
+            },
+            "block_cache": (
+                patterns_module.block_cache.stats()
+                if patterns_module.block_cache is not None
+                else None
+            ),
+        },
+    ).start()
+
+if warmup_config.get("enabled"):
+    if patterns_module.block_cache is None:
+        print("warm-up needs the block cache, skipping it")
+    else:
+        Warmup(
+            patterns_module.block_cache,
+            warmup_tasks(),
+            is_idle=lambda: not any(
+                session.producer.playing
+                for session in [default_session, *sessions.values()]
+            ),
+            workers=warmup_config.get("workers") or None,
+            blocks=warmup_config.get("blocks", WARMUP_BLOCKS),
+        ).start()
+
+
+def is_handy_host(host: str) -> bool:
+    return "handyfeeling" in host
+
+
+def handle(request: HandyRequest, received_at) -> str:
+    """Applies an API call to its session's state, returns its action.
+
+    `received_at` is when the front end started reading the request, on
+    the perf_counter clock.
+    """
+    started_at = time.perf_counter()
+    action = request.action
+    metrics.action = action
+    metrics.received_at = received_at
+    metrics.record(action, "proxy", started_at - received_at)
+    request.session = sessions.get(request.connection_key, default_session)
+    if not dispatch(request.session, request) and action not in ACTIONS:
+        print("error!", action)
+    metrics.span(action, "handle", started_at)
+    return action
@@ -0,0 +1,210 @@
+"""The Handy API's routes and the handlers that apply a call to a HandySession.
+
+Kept apart from handy.py, which opens the devices and starts their
+threads on import, so the routing can be imported on its own.
+"""
+import json
+import time
+from urllib.parse import parse_qs
+
+from configuration import configuration
+
+factors = configuration["factors"]
+
+# wall clock ms at perf_counter() == 0, fixed at startup: serverTime never jumps
+# with NTP and runs on the clock TcodeFire schedules its lines on
+CLOCK_OFFSET_MS = time.time() * 1000 - time.perf_counter() * 1000
+
+
+def server_time_ms() -> int:
+    return int(CLOCK_OFFSET_MS + time.perf_counter() * 1000)
+
+
+def get_query_param(query: dict, key: str, default: str) -> str:
+    return query.get(key, [default])[0]
+
+
+def handle_set_stroke(session, query: dict) -> None:
+    type_ = get_query_param(query, "type", "mm")
+    stroke_top = int(query["stroke"][0])
+
+    if type_ != "%":  # should be in percentage
+        stroke_top /= 2
+    session.state["stroke"]["bottom"] = 0
+    session.state["stroke"]["top"] = stroke_top
+    session.set_state("stroke", stroke_top)
+
+
+def handle_slide(session, body: dict) -> None:
+    print(body)
+    session.state["stroke"]["bottom"] = body.get("min", 0)
+    session.state["stroke"]["top"] = body.get("max", 100)
+    # max_ = body['max']
+    session.set_state("stroke", session.state["stroke"]["top"])
+
+
+def handle_set_speed(session, query: dict) -> None:
+    type_ = get_query_param(query, "type", "mm/s")
+    speed = int(query["speed"][0])
+    if type_ == "%":
+        speed = int(speed * factors["speed_factor"])
+
+    session.set_state("speed", speed)
+
+
+def handle_set_velocity(session, query: dict) -> None:
+    speed = int(query["velocity"] * factors["velocity_factor"])
+    session.set_state("speed", speed)
+
+
+def handle_set_mode(session, query: dict) -> None:
+
+    mode_value = get_query_param(query, "mode", "0")
+    if mode_value == "0":
+        session.set_state("mode", "halting")
+        print("stopping device")
+    elif mode_value == "1":
+
+        session.set_state("mode", "running")
+        print("running device")
+    else:
+        print("Unknown mode:", mode_value)
+
+
+def path_connection_key(path: str):
+    """The key v1 calls carry in their path, `/api/v1/<key>/setSpeed`, or None."""
+    parts = path.partition("?")[0].split("/")
+    if "v1" not in parts:
+        return None
+    index = parts.index("v1")
+    # the key sits between the version and the action
+    return parts[index + 1] if len(parts) > index + 2 else None
+
+
+class HandyRequest:
+    """One API call, the query and the body are parsed on first use.
+
+    The connection key comes from the X-Connection-Key header, v1 calls
+    have it in the path instead.
+    """
+
+    __slots__ = ("method", "path", "content", "connection_key", "session", "_query", "_body")
+
+    def __init__(self, method: str, path: str, content: bytes, connection_key=None) -> None:
+        self.method = method
+        self.path = path
+        self.content = content
+        self.connection_key = connection_key or path_connection_key(path)
+        # the HandySession it played on, set by `handy.handle`
+        self.session = None
+        self._query = None
+        self._body = None
+
+    @property
+    def action(self) -> str:
+        return self.path.partition("?")[0].rpartition("/")[2]
+
+    @property
+    def query(self) -> dict:
+        if self._query is None:
+            self._query = parse_qs(self.path.partition("?")[2])
+        return self._query
+
+    @property
+    def body(self) -> dict:
+        if self._body is None:
+            try:
+                self._body = json.loads(self.content.decode("utf-8"))
+            except json.decoder.JSONDecodeError:
+                self._body = {}
+        return self._body
+
+
+def handle_mode_request(session, request: HandyRequest) -> None:
+    print("setting mode...")
+    handle_set_mode(session, request.query)
+
+
+def handle_setup(session, request: HandyRequest) -> None:
+    url = request.body.get("url")
+    if not url:
+        print("setup without a script url -", request.body)
+        return
+    session.setup_script(url, request.body.get("sha256"))
+
+
+def handle_play(session, request: HandyRequest) -> None:
+    body = request.body
+    session.play_from(
+        int(body.get("startTime", 0)),
+        int(body.get("estimatedServerTime") or server_time_ms()),
+    )
+
+
+def handle_sync_time(session, request: HandyRequest) -> None:
+    body = request.body
+    if "currentTime" in body:
+        session.sync_time(
+            int(body["currentTime"]), int(body.get("serverTime") or server_time_ms())
+        )
+
+
+def handle_stop(session, request: HandyRequest) -> None:
+    if "/hssp/" in request.path:
+        session.stop_script()
+    else:
+        handle_set_mode(session, {"mode": "0"})
+
+
+def ignore(session, request: HandyRequest) -> None:
+    pass
+
+
+# the methods that change state, preflights and HEADs only ever get the reply
+METHODS = ("GET", "POST", "PUT")
+WRITE_METHODS = ("POST", "PUT")
+PREFLIGHT_METHODS = ("HEAD", "OPTIONS")
+
+# action -> (handler, methods it handles), the query and body are only parsed by handlers that need them
+ACTIONS = {
+    "setStroke": (lambda session, request: handle_set_stroke(session, request.query), METHODS),
+    "slide": (lambda session, request: handle_slide(session, request.body), WRITE_METHODS),
+    "setSpeed": (lambda session, request: handle_set_speed(session, request.query), METHODS),
+    "velocity": (
+        lambda session, request: handle_set_velocity(session, request.body),
+        WRITE_METHODS,
+    ),
+    "setMode": (handle_mode_request, METHODS),
+    "mode": (handle_mode_request, METHODS),
+    "start": (lambda session, request: handle_set_mode(session, {"mode": "1"}), METHODS),
+    "stop": (handle_stop, METHODS),
+    "getStatus": (ignore, METHODS),
+    "getVersion": (ignore, METHODS),
+    "getServerTime": (ignore, METHODS),
+    "servertime": (ignore, METHODS),
+    "latest": (ignore, METHODS),
+    "info": (ignore, METHODS),
+    "connected": (ignore, METHODS),
+    "state": (ignore, METHODS),
+    "setup": (handle_setup, METHODS),
+    "play": (handle_play, WRITE_METHODS),
+    "synctime": (handle_sync_time, WRITE_METHODS),
+    # "sse": (handle_setup, METHODS),
+}
+ROUTES = {
+    (method, action): handler
+    for action, (handler, methods) in ACTIONS.items()
+    for method in methods
+}
+ROUTES.update(
+    ((method, action), ignore) for action in ACTIONS for method in PREFLIGHT_METHODS
+)
+
+
+def dispatch(session, request: HandyRequest) -> bool:
+    """Hands `request` to its handler, returns False if no handler takes its method."""
+    handler = ROUTES.get((request.method, request.action))
+    if handler is None:
+        return False
+    handler(session, request)
+    return True
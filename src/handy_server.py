@@ -0,0 +1,206 @@
+"""Serves the Handy API straight from asyncio, without mitmproxy.
+
+    python src/handy_server.py
+
+It listens where mitmdump did, so the same PAC file points the browser
+here. A CONNECT to a Handy host is answered with a certificate signed by
+the mitmproxy CA the browser already trusts, any other CONNECT is
+tunnelled untouched.
+"""
+import asyncio
+import os
+import ssl
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from mitmproxy.certs import CertStore
+
+from configuration import configuration
+
+KEY_SIZE = 2048
+PIPE_CHUNK_BYTES = 64 * 1024
+# API calls carry a few bytes of JSON at most
+MAX_BODY_BYTES = 64 * 1024
+CONNECTED = b"HTTP/1.1 200 Connection Established\r\n\r\n"
+BAD_GATEWAY = b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+async def read_head(reader):
+    """Reads a request line and its headers, returns None once the client is gone."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    request_line, *lines = head[:-4].decode("latin-1").split("\r\n")
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return request_line.split(" ", 2), headers
+
+
+async def read_body(reader, headers) -> bytes:
+    """Reads a request body sent with a Content-Length or in chunks."""
+    if headers.get("transfer-encoding", "").lower().endswith("chunked"):
+        chunks = []
+        size = 0
+        while True:
+            # chunk extensions after a ; are ignored
+            chunk_size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+            if chunk_size == 0:
+                break
+            size += chunk_size
+            if size > MAX_BODY_BYTES:
+                raise ValueError("request body too large")
+            chunks.append(await reader.readexactly(chunk_size))
+            if await reader.readexactly(2) != b"\r\n":
+                raise ValueError("malformed chunk")
+        # trailers, up to the empty line
+        while await reader.readuntil(b"\r\n") != b"\r\n":
+            pass
+        return b"".join(chunks)
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("request body too large")
+    return await reader.readexactly(length) if length else b""
+
+
+async def pipe(reader, writer):
+    try:
+        while True:
+            data = await reader.read(PIPE_CHUNK_BYTES)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+class HandyServer:
+    """HTTP proxy front end for `handy`, sharing its state and device."""
+
+    def __init__(self, api, cert_store, cert_dir) -> None:
+        self._api = api
+        self._cert_store = cert_store
+        self._cert_dir = cert_dir
+        self._tls_contexts = {}
+        self._headers = "".join(
+            f"{name}: {value}\r\n" for name, value in api.HEADERS.items()
+        ).encode()
+
+    def _tls_context(self, host) -> ssl.SSLContext:
+        context = self._tls_contexts.get(host)
+        if context is None:
+            entry = self._cert_store.get_cert(host, [x509.DNSName(host)])
+            # ssl only loads certificates from files
+            path = os.path.join(self._cert_dir, f"{host}.pem")
+            with open(path, "wb") as file:
+                file.write(
+                    entry.privatekey.private_bytes(
+                        serialization.Encoding.PEM,
+                        serialization.PrivateFormat.TraditionalOpenSSL,
+                        serialization.NoEncryption(),
+                    )
+                )
+                file.write(entry.cert.to_pem())
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(path)
+            context.set_alpn_protocols(["http/1.1"])
+            self._tls_contexts[host] = context
+        return context
+
+    async def _serve_api(self, reader, writer, head):
+        """Answers API calls on one connection until the client closes it."""
+        while head is not None:
+            received_at = time.perf_counter()
+            (method, target, version), headers = head
+            content = await read_body(reader, headers)
+            if not target.startswith("/"):  # absolute form, plain http through the proxy
+                parts = urlsplit(target)
+                target = parts.path + ("?" + parts.query if parts.query else "")
+            request = self._api.HandyRequest(
+                method, target, content, headers.get(self._api.CONNECTION_KEY_HEADER)
+            )
+            action = self._api.handle(request, received_at)
+            handled_at = time.perf_counter()
+            body = self._api.reply_content(action, request.session)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                + self._headers
+                + b"Content-Length: %d\r\n\r\n" % len(body)
+                + body
+            )
+            self._api.metrics.span(action, "respond", handled_at)
+            await writer.drain()
+            if version == "HTTP/1.0" or headers.get("connection", "").lower() == "close":
+                break
+            head = await read_head(reader)
+
+    async def _tunnel(self, reader, writer, host, port):
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, port)
+        except OSError:
+            writer.write(BAD_GATEWAY)
+            return
+        writer.write(CONNECTED)
+        await asyncio.gather(pipe(reader, upstream_writer), pipe(upstream_reader, writer))
+
+    async def handle_client(self, reader, writer):
+        try:
+            head = await read_head(reader)
+            if head is None:
+                return
+            (method, target, _), _ = head
+            if method == "CONNECT":
+                host, _, port = target.rpartition(":")
+                if not self._api.is_handy_host(host):
+                    await self._tunnel(reader, writer, host, int(port))
+                    return
+                writer.write(CONNECTED)
+                await writer.drain()
+                await writer.start_tls(self._tls_context(host))
+                await self._serve_api(reader, writer, await read_head(reader))
+            elif self._api.is_handy_host(urlsplit(target).hostname or ""):
+                await self._serve_api(reader, writer, head)
+            else:
+                writer.write(BAD_GATEWAY)
+        except (
+            ConnectionError,
+            ssl.SSLError,
+            ValueError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+        ) as e:
+            print("connection failed -", e)
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"serving the Handy API on {host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    # imported here, the warm-up's worker processes import this module again
+    import handy
+
+    server_config = configuration.get("server", {})
+    confdir = os.path.expanduser(server_config.get("confdir", "~/.mitmproxy"))
+    cert_store = CertStore.from_store(confdir, "mitmproxy", KEY_SIZE)
+    with tempfile.TemporaryDirectory() as cert_dir:
+        server = HandyServer(handy, cert_store, cert_dir)
+        asyncio.run(
+            server.serve(server_config.get("host", "127.0.0.1"), server_config.get("port", 8080))
+        )
+
+
+if __name__ == "__main__":
+    main()
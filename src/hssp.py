@@ -0,0 +1,259 @@
+"""HSSP script playback: funscripts downloaded once, kept as arrays and streamed as lines.
+
+    python src/hssp.py DIRECTORY [PORT]
+
+serves the funscripts in DIRECTORY the way a video site does, for
+trying out `hssp/setup` without one.
+"""
+import hashlib
+import os
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import numpy as np
+
+from patterns import stroke_absolute_position
+from tcode_fire import TcodeInstruction, TcodeLine
+
+DOWNLOAD_TIMEOUT_S = 30
+SCRIPT_MAGIC = b"HSSP1\n"
+
+ACTIONS_START = re.compile(rb'"actions"\s*:\s*\[')
+
+
+def _byte_table(chars) -> np.ndarray:
+    table = np.zeros(256, dtype=bool)
+    table[list(chars)] = True
+    return table
+
+
+DIGIT = _byte_table(b"0123456789")
+# what else a JSON number is made of, an exponent's e is told apart from true/false
+NUMBER = _byte_table(b"0123456789.+-")
+EXPONENT = _byte_table(b"eE")
+QUOTE, OPEN, SPACE = ord('"'), ord("{"), ord(" ")
+AT_KEY, POS_KEY = b'"at"', b'"pos"'
+INVERTED = re.compile(rb'"inverted"\s*:\s*true')
+# what a sha256 from a request must look like before it goes near a file name
+SHA256 = re.compile(r"[0-9a-fA-F]{64}")
+
+
+class Script:
+    """A funscript as two arrays, action times in ms and positions 0-100.
+
+    The times are strictly increasing, an action at the same time as the
+    one before it replaces it.
+    """
+
+    __slots__ = ("times", "positions")
+
+    def __init__(self, times, positions) -> None:
+        self.times = times
+        self.positions = positions
+
+    @classmethod
+    def parse(cls, content: bytes):
+        """Reads the actions of a funscript in bulk, without an object per action.
+
+        The numbers are found with numpy on the raw bytes and converted in
+        one `np.fromstring`, each one belongs to the key before it and the
+        action whose brace comes before it.
+        """
+        start = ACTIONS_START.search(content)
+        if start is None:
+            raise ValueError("not a funscript, it has no actions")
+        # actions hold no lists, the first bracket closes them
+        end = content.index(b"]", start.end())
+        text = np.frombuffer(content, np.uint8, end - start.end(), start.end())
+        quotes = text == QUOTE
+        # true from an opening quote up to its closing one
+        in_string = np.bitwise_xor.accumulate(quotes)
+        number = NUMBER[text]
+        exponents = np.flatnonzero(EXPONENT[text[1:-1]]) + 1
+        number[exponents] = DIGIT[text[exponents - 1]] & number[exponents + 1]
+        number &= ~in_string
+        starts = np.flatnonzero(number[1:] & ~number[:-1]) + 1
+        if len(number) and number[0]:
+            starts = np.insert(starts, 0, 0)
+        values = np.fromstring(np.where(number, text, SPACE).tobytes(), sep=" ")
+        if len(values) != len(starts):
+            raise ValueError("not a funscript, its actions hold something other than numbers")
+
+        # the key each number is the value of, and the action it is in
+        keys = np.flatnonzero(quotes & in_string)
+        # a number before any key gets the end of the text, which is no key
+        key = np.append(keys, len(text))[np.searchsorted(keys, starts) - 1]
+        action = np.searchsorted(np.flatnonzero(text == OPEN), starts)
+        at, pos = _is_key(text, key, AT_KEY), _is_key(text, key, POS_KEY)
+        # actions with both, in the order they come
+        _, at_index, pos_index = np.intersect1d(action[at], action[pos], return_indices=True)
+        times = values[at][at_index].round().astype(np.int32)
+        positions = values[pos][pos_index].round().clip(0, 100).astype(np.uint8)
+        if INVERTED.search(content) is not None:
+            positions = 100 - positions
+        order = np.argsort(times, kind="stable")
+        times, positions = times[order], positions[order]
+        # of the actions at the same time, the last one wins
+        last = np.ones(len(times), dtype=bool)
+        last[:-1] = times[1:] != times[:-1]
+        return cls(
+            array("i", times[last].tobytes()), array("B", positions[last].tobytes())
+        )
+
+    @classmethod
+    def read(cls, path):
+        with open(path, "rb") as file:
+            if file.readline() != SCRIPT_MAGIC:
+                raise ValueError(f"{path} is not a parsed script")
+            count = int(file.readline())
+            times = array("i")
+            times.fromfile(file, count)
+            positions = array("B")
+            positions.fromfile(file, count)
+        return cls(times, positions)
+
+    def write(self, path):
+        """Writes the arrays to `path` through a temporary file, readers never see half a script."""
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as file:
+            file.write(SCRIPT_MAGIC + b"%d\n" % len(self))
+            self.times.tofile(file)
+            self.positions.tofile(file)
+        os.replace(temporary, path)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration_ms(self):
+        return self.times[-1] if self.times else 0
+
+    def index_at(self, at_ms) -> int:
+        """The first action at or after `at_ms`, a binary search of `times`."""
+        return bisect_left(self.times, at_ms)
+
+    def lines(self, start_ms=0, bottom=0, top=100):
+        """Streams one L0 move per action from `start_ms` on, scaled into bottom..top.
+
+        Takes the `patterns.sample_axes` updates: a `step` continues from
+        that line, a new `bottom` or `top` rescales the moves after it.
+        """
+        times, positions = self.times, self.positions
+        first = self.index_at(start_ms)
+        step = 0
+        update = None
+        while first + step < len(times):
+            index = first + step
+            previous_ms = times[index - 1] if step else start_ms
+            position = stroke_absolute_position(bottom + (top - bottom) * positions[index] / 100)
+            update = yield TcodeLine(
+                [TcodeInstruction("L0", position, times[index] - previous_ms)]
+            )
+            step += 1
+            if update is not None:
+                step = update.get("step", step)
+                bottom = update.get("bottom", bottom)
+                top = update.get("top", top)
+
+
+def _is_key(text, starts, name) -> np.ndarray:
+    """True for each string in `text` starting at `starts` that is `name`."""
+    is_name = np.ones(len(starts), dtype=bool)
+    for offset, char in enumerate(name):
+        at = starts + offset
+        inside = at < len(text)
+        is_name &= inside
+        is_name[inside] &= text[at[inside]] == char
+    return is_name
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def download(url, timeout_s=DOWNLOAD_TIMEOUT_S) -> bytes:
+    response = httpx.get(url, timeout=timeout_s, follow_redirects=True)
+    response.raise_for_status()
+    return response.content
+
+
+class ScriptCache:
+    """Parsed scripts on disk, by content hash, and the content hash each URL had.
+
+    A URL loaded before is neither downloaded nor parsed again. A known
+    `sha256` skips the download even for a new URL, an unknown one is
+    checked against what the URL serves.
+    """
+
+    def __init__(self, directory, fetch=download) -> None:
+        self._directory = directory
+        self._fetch = fetch
+        os.makedirs(os.path.join(directory, "urls"), exist_ok=True)
+        self.downloads = 0
+        self.parses = 0
+
+    def _script_path(self, sha256):
+        return os.path.join(self._directory, f"{sha256}.script")
+
+    def _url_path(self, url):
+        return os.path.join(self._directory, "urls", content_hash(url.encode()))
+
+    def _cached(self, sha256):
+        path = self._script_path(sha256)
+        if sha256 and os.path.exists(path):
+            try:
+                return Script.read(path)
+            except (OSError, ValueError) as e:
+                print("cached script unreadable -", e)
+        return None
+
+    def load(self, url, sha256=None) -> Script:
+        if sha256 is not None:
+            if isinstance(sha256, str) and SHA256.fullmatch(sha256):
+                sha256 = sha256.lower()
+            else:
+                print("ignoring a sha256 that is not one -", sha256)
+                sha256 = None
+        url_path = self._url_path(url)
+        if sha256 is None and os.path.exists(url_path):
+            with open(url_path, encoding="utf-8") as file:
+                sha256 = file.read().strip()
+        script = self._cached(sha256)
+        if script is not None:
+            return script
+
+        content = self._fetch(url)
+        self.downloads += 1
+        actual = content_hash(content)
+        if sha256 is not None and actual != sha256:
+            print(f"script hash mismatch for {url}, expected {sha256}, got {actual}")
+        script = self._cached(actual)
+        if script is None:
+            script = Script.parse(content)
+            self.parses += 1
+            script.write(self._script_path(actual))
+        with open(url_path, "w", encoding="utf-8") as file:
+            file.write(actual)
+        return script
+
+
+def serve_scripts(directory, host="127.0.0.1", port=0) -> ThreadingHTTPServer:
+    """Serves the files in `directory` over http on a daemon thread, see `server_address`."""
+    server = ThreadingHTTPServer(
+        (host, port), partial(SimpleHTTPRequestHandler, directory=directory)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    server = serve_scripts(sys.argv[1], port=int(sys.argv[2]) if len(sys.argv) > 2 else 8082)
+    host, port = server.server_address
+    print(f"serving {sys.argv[1]} on http://{host}:{port}/")
+    threading.Event().wait()
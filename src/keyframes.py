@@ -0,0 +1,142 @@
+import heapq
+from itertools import count
+
+from tcode_fire import TcodeInstruction, TcodeLine
+
+# position units a skipped sample may be away from the interpolated path
+KEYFRAME_TOLERANCE = 1
+# an axis gets a keyframe at least this often, even when it holds still
+MAX_KEYFRAME_INTERVAL_MS = 1000
+
+
+def _direction(delta):
+    return (delta > 0) - (delta < 0)
+
+
+class _AxisTrack:
+    """Samples of one axis that are not covered by a keyframe yet.
+
+    A sample is `(issue_ms, arrival_ms, value)`: the command goes out at
+    `issue_ms` and the axis reaches `value` at `arrival_ms`.
+    """
+
+    def __init__(self, tolerance, max_interval_ms) -> None:
+        self._tolerance = tolerance
+        self._max_interval_ms = max_interval_ms
+        self.value = None
+        self.pending = []
+
+    def add(self, sample) -> list:
+        """Adds a sample and returns the keyframes it closed off."""
+        keyframes = []
+        if self.pending:
+            last = self.pending[-1]
+            if last[0] == last[1] == sample[0]:
+                # a jump the axis is sent on from in the same instant, only the move counts
+                self.pending.pop()
+            elif not self._extends(sample):
+                keyframes.append(self.close())
+        self.pending.append(sample)
+        # nothing to interpolate from yet, a jump waits for what follows it
+        if self.value is None and sample[0] != sample[1]:
+            keyframes.append(self.close())
+        return keyframes
+
+    def _extends(self, sample) -> bool:
+        last = self.pending[-1]
+        if sample[0] != last[1]:  # the axis was meant to rest in between
+            return False
+        previous = self.pending[-2][2] if len(self.pending) > 1 else self.value
+        if _direction(last[2] - previous) * _direction(sample[2] - last[2]) < 0:
+            return False  # turning point
+        start_ms = self.pending[0][0]
+        end_ms, end_value = sample[1], sample[2]
+        if end_ms - start_ms > self._max_interval_ms:
+            return False
+        for _, arrival_ms, value in self.pending:
+            expected = self.value + (end_value - self.value) * (
+                (arrival_ms - start_ms) / (end_ms - start_ms)
+            )
+            if abs(value - expected) > self._tolerance:
+                return False
+        return True
+
+    def close(self):
+        issue_ms = self.pending[0][0]
+        _, arrival_ms, value = self.pending[-1]
+        self.value = value
+        self.pending = []
+        return issue_ms, value, arrival_ms - issue_ms
+
+
+def compress_keyframes(
+    lines, tolerance=KEYFRAME_TOLERANCE, max_interval_ms=MAX_KEYFRAME_INTERVAL_MS
+):
+    """Thins a stream of TcodeLines down to per-axis keyframes.
+
+    The firmware interpolates linearly over each `I` interval, so an axis
+    only needs a command at its turning points and wherever the straight
+    path would miss a sample by more than `tolerance`. Every axis gets its
+    own interval and a line is sent whenever any axis needs a new one.
+    """
+    tracks = {}
+    keyframes = []  # heap of (issue_ms, seq, axis, value, interval_ms)
+    seq = count()
+    now_ms = 0
+    for line in lines:
+        for instruction in line.instructions:
+            track = tracks.get(instruction.axis)
+            if track is None:
+                track = tracks[instruction.axis] = _AxisTrack(tolerance, max_interval_ms)
+            sample = (now_ms, now_ms + instruction.duration_ms, instruction.value)
+            for issue_ms, value, interval_ms in track.add(sample):
+                heapq.heappush(
+                    keyframes, (issue_ms, next(seq), instruction.axis, value, interval_ms)
+                )
+        now_ms += line.duration_ms
+
+        # an open track will send its next keyframe at its first pending sample,
+        # and nothing can be issued before that or before the next input line
+        pending_ms = min(
+            (track.pending[0][0] for track in tracks.values() if track.pending),
+            default=None,
+        )
+        bound_ms = now_ms if pending_ms is None else min(pending_ms, now_ms)
+        while keyframes and keyframes[0][0] < bound_ms:
+            group = _pop_group(keyframes)
+            if keyframes and keyframes[0][0] <= bound_ms:
+                next_ms = keyframes[0][0]
+            elif pending_ms == bound_ms:
+                next_ms = bound_ms
+            else:  # the next line's time is not known yet
+                for keyframe in group:
+                    heapq.heappush(keyframes, keyframe)
+                break
+            yield _line(group, next_ms)
+
+    # the input ended, whatever is still open is a keyframe now
+    for axis, track in tracks.items():
+        if track.pending:
+            issue_ms, value, interval_ms = track.close()
+            heapq.heappush(keyframes, (issue_ms, next(seq), axis, value, interval_ms))
+    while keyframes:
+        group = _pop_group(keyframes)
+        # the last line lasts as long as the input did
+        next_ms = keyframes[0][0] if keyframes else max(now_ms, group[0][0])
+        yield _line(group, next_ms)
+
+
+def _pop_group(keyframes) -> list:
+    """Pops the keyframes issued at the earliest time."""
+    issue_ms = keyframes[0][0]
+    group = []
+    while keyframes and keyframes[0][0] == issue_ms:
+        group.append(heapq.heappop(keyframes))
+    return group
+
+
+def _line(group, next_ms):
+    return TcodeLine(
+        [TcodeInstruction(axis, value, interval_ms) for _, _, axis, value, interval_ms in group],
+        next_ms - group[0][0],
+    )
@@ -0,0 +1,154 @@
+import json
+import math
+import os
+import threading
+import time
+
+# histogram buckets grow by 10%, from 1 us up to ~100 s
+BUCKET_GROWTH = 1.1
+BUCKET_MIN_S = 1e-6
+BUCKET_COUNT = 194
+METRICS_INTERVAL_S = 1.0
+
+
+class Histogram:
+    """Latency samples in log-spaced buckets, percentiles are accurate to ~10%."""
+
+    def __init__(self) -> None:
+        self._buckets = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def record(self, seconds):
+        index = 0
+        if seconds > BUCKET_MIN_S:
+            index = min(
+                int(math.log(seconds / BUCKET_MIN_S, BUCKET_GROWTH)) + 1,
+                BUCKET_COUNT - 1,
+            )
+        self._buckets[index] += 1
+        self.count += 1
+        self.total_s += seconds
+        self.max_s = max(self.max_s, seconds)
+
+    def percentile(self, q):
+        """Upper edge of the bucket holding the `q` quantile, in seconds."""
+        rank = q * self.count
+        seen = 0
+        for index, bucket in enumerate(self._buckets):
+            seen += bucket
+            if seen >= rank and bucket:
+                return min(BUCKET_MIN_S * BUCKET_GROWTH**index, self.max_s)
+        return self.max_s
+
+    def snapshot(self) -> dict:
+        if self.count == 0:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": self.total_s / self.count * 1000,
+            "p50_ms": self.percentile(0.50) * 1000,
+            "p95_ms": self.percentile(0.95) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+            "max_ms": self.max_s * 1000,
+        }
+
+
+class LatencyMetrics:
+    """Per-action histograms of the stages between a request and the device.
+
+    Times are `time.perf_counter()` values. `expect_first_write` remembers
+    when the request behind a new generation started, `first_write` closes
+    that span once TcodeFire sent the generation's first line. Both are
+    keyed by the Handy session, every session counts its own generations.
+    """
+
+    def __init__(self) -> None:
+        self._histograms = {}
+        # session -> the generation it waits on the first line of, and its request
+        self._pending = {}
+        # the Handy action being handled and when its request came in,
+        # the proxy handles one request at a time
+        self.action = None
+        self.received_at = None
+        self._lock = threading.Lock()
+
+    def record(self, action, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.setdefault(action, {}).get(stage)
+            if histogram is None:
+                histogram = self._histograms[action][stage] = Histogram()
+            histogram.record(seconds)
+
+    def span(self, action, stage, started_at):
+        """Records the time since `started_at` and returns now, to chain spans."""
+        now = time.perf_counter()
+        self.record(action, stage, now - started_at)
+        return now
+
+    def expect_first_write(self, session, generation, action, started_at, handled_at):
+        with self._lock:
+            self._pending[session] = (generation, action, started_at, handled_at)
+
+    def first_write(self, session, generation, fired_at):
+        with self._lock:
+            pending = self._pending.get(session)
+            if pending is None or pending[0] != generation:
+                return
+            del self._pending[session]
+        _, action, started_at, handled_at = pending
+        self.record(action, "wakeup", fired_at - handled_at)
+        self.record(action, "first_byte", fired_at - started_at)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                action: {stage: h.snapshot() for stage, h in stages.items()}
+                for action, stages in self._histograms.items()
+            }
+
+
+class MetricsWriter(threading.Thread):
+    """Dumps a metrics snapshot to a json file every `interval_s` seconds.
+
+    The proxy and the FastAPI file server are different processes, the
+    server's /metrics endpoint just reads this file.
+    """
+
+    def __init__(self, metrics, path, interval_s=METRICS_INTERVAL_S, extra=None) -> None:
+        super().__init__(daemon=True)
+        self._metrics = metrics
+        self._path = path
+        self._interval_s = interval_s
+        # callable returning more sections to add, e.g. the TcodeFire stats
+        self._extra = extra
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def write(self):
+        snapshot = {"updated": time.time(), "actions": self._metrics.snapshot()}
+        if self._extra is not None:
+            snapshot.update(self._extra())
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(snapshot, file)
+        os.replace(temp_path, self._path)
+
+    def run(self) -> None:
+        while not self._stopped.wait(self._interval_s):
+            try:
+                self.write()
+            # whatever goes wrong, the next snapshot is still worth trying
+            except Exception as e:
+                print("could not write metrics -", e)
+
+
+def read_metrics(path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
@@ -0,0 +1,21 @@
+HANDY_HOST = "www.handyfeeling.com"
+
+PAC_TEMPLATE = """function FindProxyForURL(url, host) {
+
+  if (shExpMatch(host, "%(handy_host)s")) {
+    if (shExpMatch(url, "*see*")) {
+      return "DIRECT";  // Bypass proxy for this specific path
+    }
+    else {
+      // servertime included, the proxy answers it from its own clock
+      return "PROXY %(proxy)s";
+    }
+  }
+  return "DIRECT";  // Bypass proxy for all other hosts
+}
+"""
+
+
+def pac_script(host="127.0.0.1", port=8080) -> str:
+    """The proxy auto-config that sends every Handy API call to the proxy at host:port."""
+    return PAC_TEMPLATE % {"handy_host": HANDY_HOST, "proxy": f"{host}:{port}"}
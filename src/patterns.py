@@ -1,12 +1,18 @@
 import math
 import random
-from itertools import count, cycle
 from functools import partial
 
+import numpy as np
+
 from configuration import configuration
-from tcode_fire import TcodeInstruction, TcodeLine
+from tcode_fire import TcodeBlock, TcodeInstruction, TcodeLine
 
 INIT_TIME_DURATION_MS = 300
+STEP_SIZE_MS = 50
+# steps rendered at once by the sampled patterns
+BLOCK_STEPS = 64
+# BlockCache shared by the sampled patterns, set by the proxy (None renders every block)
+block_cache = None
 
 
 def calculate_bpm(distance_mm, velocity_mm_per_s):
@@ -52,6 +58,170 @@ def get_absolute_position(min_bound, max_bound, relative_position):
     return int(absolute_position)
 
 
+class CycleAxis:
+    """An axis that loops over a precomputed list of positions."""
+
+    def __init__(self, axis, positions) -> None:
+        if len(positions) == 0:
+            raise ValueError(f"{axis} has no positions to cycle")
+        self.axis = axis
+        self._positions = np.asarray(positions, dtype=np.int64)
+        self._offset = 0
+
+    def render(self, steps, t):
+        return self._positions[(steps + self._offset) % len(self._positions)]
+
+    def continue_from(self, previous, step, t):
+        """Shifts the cycle so `step` follows on from where `previous` was at `step - 1`."""
+        if step == 0:
+            return
+        last, heading = previous.render(np.array([step - 1, step]), None).tolist()
+        positions = self._positions
+        direction = np.sign(np.roll(positions, -1) - positions)
+        candidates = np.flatnonzero(direction == np.sign(heading - last))
+        if len(candidates) == 0:
+            candidates = np.arange(len(positions))
+        nearest = candidates[np.argmin(np.abs(positions[candidates] - last))]
+        self._offset = int(nearest + 1 - step) % len(positions)
+
+
+class OrbitalAxis:
+    """An axis following `get_orbital_position` at a constant angular speed."""
+
+    def __init__(self, axis, angular_speed, top_limit, bottom_limit, phase, ecc) -> None:
+        self.axis = axis
+        self._angular_speed = angular_speed
+        self._top_limit = top_limit
+        self._bottom_limit = bottom_limit
+        self._phase = phase
+        self._ecc = ecc
+        # the angle is angle0 at t0, 0 at 0 unless the axis was retargeted
+        self._t0 = 0
+        self._angle0 = 0.0
+
+    def _angle(self, t):
+        return self._angular_speed * (t - self._t0) + self._angle0
+
+    def render(self, steps, t):
+        midpoint = (self._top_limit + self._bottom_limit) / 2
+        range_val = (self._top_limit - self._bottom_limit) / 2
+        shifted = self._angle(t) + self._phase * math.pi / 2
+        values = midpoint + range_val * np.cos(shifted + self._ecc * np.sin(shifted))
+        positions = np.trunc(values).astype(np.int64)
+        # numpy's cos/sin may differ from libm in the last bit, which only
+        # matters when truncating a value that sits right on an integer
+        for i in np.flatnonzero(np.abs(values - np.round(values)) < 1e-9):
+            positions[i] = get_orbital_position(
+                self._angle(int(t[i])),
+                self._top_limit,
+                self._bottom_limit,
+                self._phase,
+                self._ecc,
+            )
+        return positions
+
+    def continue_from(self, previous, step, t):
+        """Keeps the angle continuous at `t` when the angular speed changes."""
+        self._t0 = t
+        self._angle0 = previous._angle(t)
+
+
+class PatternBlock:
+    """`len(axes)` positions and one duration for each of a run of steps."""
+
+    def __init__(self, axes, positions, durations) -> None:
+        self.axes = axes
+        self.positions = positions
+        self.durations = durations
+
+    def __len__(self):
+        return len(self.durations)
+
+    def to_tcode_block(self) -> TcodeBlock:
+        block = TcodeBlock()
+        # format every distinct position once per axis, most steps repeat
+        columns = []
+        for axis, column in zip(self.axes, self.positions.T.tolist()):
+            tokens = {value: f"{axis}{value:02d}" for value in set(column)}
+            columns.append([tokens[value] for value in column])
+        for duration, row in zip(self.durations.tolist(), zip(*columns)):
+            suffix = f"I{duration}"
+            block.append(
+                ((suffix + " ").join(row) + suffix + "\n").encode(), duration
+            )
+        return block
+
+
+def render_block(axes, start, count, step_size_ms=STEP_SIZE_MS) -> PatternBlock:
+    """Renders steps `start` .. `start + count` of a sampled pattern at once."""
+    steps = np.arange(start, start + count, dtype=np.int64)
+    t = (steps + 1) * step_size_ms
+    positions = np.empty((count, len(axes)), dtype=np.int16)
+    for column, axis in enumerate(axes):
+        positions[:, column] = axis.render(steps, t)
+    durations = np.full(count, step_size_ms, dtype=np.int32)
+    if start == 0 and count:
+        durations[0] = INIT_TIME_DURATION_MS
+    return PatternBlock(tuple(axis.axis for axis in axes), positions, durations)
+
+
+PARAMETERS = ("top", "bottom", "back", "forth", "speed")
+
+
+def updated_parameters(parameters, update) -> tuple:
+    """Applies an update dict (keys from PARAMETERS) to a pattern's argument tuple."""
+    return tuple(
+        update.get(name, value) for name, value in zip(PARAMETERS, parameters)
+    )
+
+
+def render_tcode_block(axes, start, step_size_ms=STEP_SIZE_MS, cache_key=None) -> TcodeBlock:
+    """Renders and encodes a block, through `block_cache` when a key is given."""
+    if block_cache is None or cache_key is None:
+        return render_block(axes, start, BLOCK_STEPS, step_size_ms).to_tcode_block()
+    key = cache_key + (start,)
+    block = block_cache.get(key)
+    if block is None:
+        block = render_block(axes, start, BLOCK_STEPS, step_size_ms).to_tcode_block()
+        block_cache.put(key, block)
+    return block
+
+
+def block_cache_key(build_axes, parameters, step_size_ms=STEP_SIZE_MS) -> tuple:
+    """The `block_cache` key of a stream, the start step of a block is added to it."""
+    return (build_axes.__name__, parameters, step_size_ms)
+
+
+def sample_axes(build_axes, parameters, step_size_ms=STEP_SIZE_MS):
+    """Streams a sampled pattern block by block.
+
+    Send a dict with new `top`, `bottom`, `back`, `forth` or `speed` to
+    retarget it, the axes carry on from their current position and phase.
+    A `step` in the dict moves the stream to that step first, so a caller
+    that dropped lines it had buffered can continue after the last line
+    it actually used.
+    """
+    if block_cache is not None:
+        parameters = block_cache.quantize(parameters)
+    axes = build_axes(*parameters)
+    # until it is retargeted, the stream only depends on the parameters
+    cache_key = block_cache_key(build_axes, parameters, step_size_ms)
+    step = 0
+    while True:
+        for line in render_tcode_block(axes, step, step_size_ms, cache_key):
+            update = yield line
+            step += 1
+            if update is not None:
+                step = update.get("step", step)
+                parameters = updated_parameters(parameters, update)
+                retargeted = build_axes(*parameters)
+                for axis, previous in zip(retargeted, axes):
+                    axis.continue_from(previous, step, step * step_size_ms)
+                axes = retargeted
+                cache_key = None
+                break
+
+
 ranges = configuration["ranges"]
 stroke_absolute_position = partial(
     get_absolute_position,
@@ -96,52 +266,70 @@ def costumed_stroke_half_twist_costumed_surge_smooth_motion_generator(
     relative_back,
     relative_forth,
     speed,
+    seed=None,
 ):
-    top = stroke_absolute_position(relative_top)
-    bottom = stroke_absolute_position(relative_bottom)
-    total_duration = int(abs(top - bottom) / speed * 2)
-    factor = int(total_duration // 2 * 0.1)
-    duration_up = total_duration // 2 + random.randint(-1 * factor, factor + 1)
-    duration_down = total_duration - duration_up
+    """Alternates an up and a down stroke, retargeted like `sample_axes`.
+
+    The stroke timing and the L1/R1 choice are random, pass a `seed` to
+    get the same motion for the same arguments.
+    """
+    rng = random if seed is None else random.Random(seed)
     valve_0 = valve_absolute_position(0)
     valve_1 = valve_absolute_position(100)
+    parameters = (relative_top, relative_bottom, relative_back, relative_forth, speed)
+    step = 0
+    update = {}
     while True:
-        L1_R1 = random.choice(["L1", "R1"])
+        if update is not None:
+            step = update.get("step", step)
+            parameters = updated_parameters(parameters, update)
+            relative_top, relative_bottom, relative_back, relative_forth, speed = parameters
+            top = stroke_absolute_position(relative_top)
+            bottom = stroke_absolute_position(relative_bottom)
+            total_duration = int(abs(top - bottom) / speed * 2)
+            factor = int(total_duration // 2 * 0.1)
+            duration_up = total_duration // 2 + rng.randint(-1 * factor, factor + 1)
+            duration_down = total_duration - duration_up
+        if step % 2 == 0:
+            L1_R1 = rng.choice(["L1", "R1"])
         if L1_R1 == "L1":
             back = surge_absolute_position(relative_back)
             forth = surge_absolute_position(relative_forth)
         else:  # R1
             back = roll_absolute_position(relative_back)
             forth = roll_absolute_position(relative_forth)
-        yield TcodeLine(
-            [
-                TcodeInstruction("L0", top, duration_up),
-                TcodeInstruction(L1_R1, back, duration_up),
-                TcodeInstruction("R0", 50, duration_up),
-                TcodeInstruction("A0", valve_1, duration_up),
-            ]
-        )
-        yield TcodeLine(
-            [
-                TcodeInstruction("L0", bottom, duration_down),
-                TcodeInstruction(L1_R1, forth, duration_down),
-                TcodeInstruction("R0", 0, duration_down),
-                TcodeInstruction("A0", valve_0, duration_down),
-            ]
-        )
-
-
-def full_stroke_with_roll_motion(
+        if step % 2 == 0:
+            update = yield TcodeLine(
+                [
+                    TcodeInstruction("L0", top, duration_up),
+                    TcodeInstruction(L1_R1, back, duration_up),
+                    TcodeInstruction("R0", 50, duration_up),
+                    TcodeInstruction("A0", valve_1, duration_up),
+                ]
+            )
+        else:
+            update = yield TcodeLine(
+                [
+                    TcodeInstruction("L0", bottom, duration_down),
+                    TcodeInstruction(L1_R1, forth, duration_down),
+                    TcodeInstruction("R0", 0, duration_down),
+                    TcodeInstruction("A0", valve_0, duration_down),
+                ]
+            )
+        step += 1
+
+
+def full_stroke_with_roll_motion_axes(
     relative_top, relative_bottom, relative_back, relative_forth, linear_speed
 ):
-    step_size_ms = 50
+    step_size_ms = STEP_SIZE_MS
 
     # Stroke
     top = stroke_absolute_position(relative_top)
     bottom = stroke_absolute_position(relative_bottom)
     stroke_increment = max([int(step_size_ms * linear_speed), 1])
     top_to_bottom = list(range(top, bottom - stroke_increment, -1 * stroke_increment))
-    top_to_bottom = cycle(top_to_bottom + list(reversed(top_to_bottom[0:-1])))
+    top_to_bottom = top_to_bottom + list(reversed(top_to_bottom[0:-1]))
 
     # ROLL
     back = roll_absolute_position(relative_back)
@@ -158,46 +346,34 @@ def full_stroke_with_roll_motion(
     valve_1 = valve_absolute_position(0)
     valve_radius = abs(valve_0 - valve_1) + 1
     angular_speed_valve = linear_speed / valve_radius
-    t = 0
-    delay_time = INIT_TIME_DURATION_MS
-    while True:
-        t += step_size_ms
-        yield TcodeLine(
-            [
-                TcodeInstruction("L0", next(top_to_bottom), delay_time),
-                TcodeInstruction(
-                    "R1",
-                    get_orbital_position(angular_speed_roll * t, back, forth, 1, -0.1),
-                    delay_time,
-                ),
-                TcodeInstruction(
-                    "R0",
-                    get_orbital_position(angular_speed_twist * t, t0, t1, -1, 0.1),
-                    delay_time,
-                ),
-                TcodeInstruction(
-                    "A0",
-                    get_orbital_position(
-                        angular_speed_valve * t, valve_0, valve_1, -1, 0.1
-                    ),
-                    delay_time,
-                ),
-            ]
-        )
-        delay_time = step_size_ms
+    return [
+        CycleAxis("L0", top_to_bottom),
+        OrbitalAxis("R1", angular_speed_roll, back, forth, 1, -0.1),
+        OrbitalAxis("R0", angular_speed_twist, t0, t1, -1, 0.1),
+        OrbitalAxis("A0", angular_speed_valve, valve_0, valve_1, -1, 0.1),
+    ]
 
 
-def full_stroke_with_pitch_motion(
+def full_stroke_with_roll_motion(
+    relative_top, relative_bottom, relative_back, relative_forth, linear_speed
+):
+    yield from sample_axes(
+        full_stroke_with_roll_motion_axes,
+        (relative_top, relative_bottom, relative_back, relative_forth, linear_speed),
+    )
+
+
+def full_stroke_with_pitch_motion_axes(
     relative_top, relative_bottom, relative_back, relative_forth, linear_speed
 ):
-    step_size_ms = 50
+    step_size_ms = STEP_SIZE_MS
 
     # Stroke
     top = stroke_absolute_position(relative_top)
     bottom = stroke_absolute_position(relative_bottom)
     stroke_increment = max([int(step_size_ms * linear_speed), 1])
     top_to_bottom = list(range(top, bottom - stroke_increment, -1 * stroke_increment))
-    top_to_bottom = cycle(top_to_bottom + list(reversed(top_to_bottom[0:-1])))
+    top_to_bottom = top_to_bottom + list(reversed(top_to_bottom[0:-1]))
 
     # PITCH
     back = pitch_absolute_position(relative_back)
@@ -215,34 +391,21 @@ def full_stroke_with_pitch_motion(
     valve_1 = valve_absolute_position(0)
     valve_radius = abs(valve_0 - valve_1) + 1
     angular_speed_valve = linear_speed / valve_radius
-    delay_time = INIT_TIME_DURATION_MS
-    t = 0
+    return [
+        CycleAxis("L0", top_to_bottom),
+        OrbitalAxis("R2", angular_speed_pitch, back, forth, 1, -0.1),
+        OrbitalAxis("R0", angular_speed_twist, t0, t1, -1, 0.1),
+        OrbitalAxis("A0", angular_speed_valve, valve_0, valve_1, -1, 0.1),
+    ]
 
-    while True:
-        t += step_size_ms
-        yield TcodeLine(
-            [
-                TcodeInstruction("L0", next(top_to_bottom), delay_time),
-                TcodeInstruction(
-                    "R2",
-                    get_orbital_position(angular_speed_pitch * t, back, forth, 1, -0.1),
-                    delay_time,
-                ),
-                TcodeInstruction(
-                    "R0",
-                    get_orbital_position(angular_speed_twist * t, t0, t1, -1, 0.1),
-                    delay_time,
-                ),
-                TcodeInstruction(
-                    "A0",
-                    get_orbital_position(
-                        angular_speed_valve * t, valve_0, valve_1, -1, 0.1
-                    ),
-                    delay_time,
-                ),
-            ]
-        )
-        delay_time = step_size_ms
+
+def full_stroke_with_pitch_motion(
+    relative_top, relative_bottom, relative_back, relative_forth, linear_speed
+):
+    yield from sample_axes(
+        full_stroke_with_pitch_motion_axes,
+        (relative_top, relative_bottom, relative_back, relative_forth, linear_speed),
+    )
 
 
 def generate_wild_stroke_pattern(top, bottom, step_size_ms, linear_speed):
@@ -264,15 +427,13 @@ def generate_wild_stroke_pattern(top, bottom, step_size_ms, linear_speed):
     downward = list(reversed(upward))
 
     # Combine upward and downward to form a cycle
-    motion_pattern = cycle(upward + downward)
+    return upward + downward
 
-    return motion_pattern
 
-
-def wild_stroke_and_pitch(
+def wild_stroke_and_pitch_axes(
     relative_top, relative_bottom, relative_back, relative_forth, linear_speed
 ):
-    step_size_ms = 50
+    step_size_ms = STEP_SIZE_MS
 
     # Stroke
     top = stroke_absolute_position(relative_top)
@@ -296,50 +457,41 @@ def wild_stroke_and_pitch(
     # valve
 
     # open_to_close = cycle([0, 10,10,10,10,10 0, 20,20,20,20,20,20,20,20, 0, 30,30,30,30,30,30,30,30,30,30,30, 0, 40,40,40,40,40,40,40,40,40,40,40,40,40,40,40,40,40,40,40,40,40, 20, 20,20,20,50,50,50,50,50,50,50,50,50,50,50,50,50,50,50,50,50,50,50,50, 30, 60,60,60,60,60,60,60,60,60,60,60,60,60,60,60,60,60,60,60,60,60, 0, 0, 0, 0, 0])
-    open_to_close = cycle(
-        [
-            # *[0, *[10] * 20],
-            *[0] * 10,
-            *[20] * 20,
-            *[0] * 10,
-            *[30] * 20,
-            *[0] * 10,
-            *[40] * 30,
-            *[10] * 10,
-            *[50] * 30,
-            *[30] * 10,
-            *[60] * 40,
-            *[0] * 20,
-        ]
-    )
-    t = 0
-    delay_time = INIT_TIME_DURATION_MS
+    open_to_close = [
+        # *[0, *[10] * 20],
+        *[0] * 10,
+        *[20] * 20,
+        *[0] * 10,
+        *[30] * 20,
+        *[0] * 10,
+        *[40] * 30,
+        *[10] * 10,
+        *[50] * 30,
+        *[30] * 10,
+        *[60] * 40,
+        *[0] * 20,
+    ]
+    return [
+        CycleAxis("L0", top_to_bottom),
+        OrbitalAxis("R2", angular_speed_pitch, back, forth, 1, -0.8),
+        OrbitalAxis("R0", angular_speed_twist, t0, t1, -1, 0.1),
+        CycleAxis("A0", open_to_close),
+    ]
 
-    while True:
-        t += step_size_ms
-        yield TcodeLine(
-            [
-                TcodeInstruction("L0", next(top_to_bottom), delay_time),
-                TcodeInstruction(
-                    "R2",
-                    get_orbital_position(angular_speed_pitch * t, back, forth, 1, -0.8),
-                    delay_time,
-                ),
-                TcodeInstruction(
-                    "R0",
-                    get_orbital_position(angular_speed_twist * t, t0, t1, -1, 0.1),
-                    delay_time,
-                ),
-                TcodeInstruction("A0", next(open_to_close), delay_time),
-            ]
-        )
-        delay_time = step_size_ms
 
+def wild_stroke_and_pitch(
+    relative_top, relative_bottom, relative_back, relative_forth, linear_speed
+):
+    yield from sample_axes(
+        wild_stroke_and_pitch_axes,
+        (relative_top, relative_bottom, relative_back, relative_forth, linear_speed),
+    )
 
-def long_stroke_1(
+
+def long_stroke_1_axes(
     relative_top, relative_bottom, relative_back, relative_forth, linear_speed
 ):
-    step_size_ms = 50
+    step_size_ms = STEP_SIZE_MS
 
     # Stroke
     top = stroke_absolute_position(relative_top)
@@ -347,7 +499,7 @@ def long_stroke_1(
     stroke_increment = max([int(step_size_ms * linear_speed), 1])
     top_to_bottom = list(range(top, bottom - stroke_increment, -1 * stroke_increment))
     stroke_size = len(top_to_bottom)
-    top_to_bottom = cycle(top_to_bottom + list(reversed(top_to_bottom[0:-1])))
+    top_to_bottom = top_to_bottom + list(reversed(top_to_bottom[0:-1]))
 
     # Surge
     back = surge_absolute_position(relative_back)
@@ -357,7 +509,7 @@ def long_stroke_1(
     )
     surge_increment = max([surge_increment, 1])
     back_to_forth = list(range(forth, back - surge_increment, -1 * surge_increment))
-    back_to_forth = cycle(back_to_forth + list(reversed(back_to_forth[0:-1])))
+    back_to_forth = back_to_forth + list(reversed(back_to_forth[0:-1]))
     # valve
     valve_0 = valve_absolute_position(0)
     valve_100 = valve_absolute_position(100)
@@ -369,7 +521,7 @@ def long_stroke_1(
     close_to_open = list(
         range(valve_100, max([valve_0 - valve_increment, 0]), -1 * valve_increment)
     )
-    close_to_open = cycle(close_to_open + list(reversed(close_to_open[0:-1])))
+    close_to_open = close_to_open + list(reversed(close_to_open[0:-1]))
 
     # pitch
     pitch_back = pitch_absolute_position(100)
@@ -382,38 +534,28 @@ def long_stroke_1(
     roll_forth = roll_absolute_position(30)
 
     angular_speed_roll = calculate_angular_velocity(abs(top - bottom), linear_speed)
-    t = 0
-    duration = INIT_TIME_DURATION_MS
-    while True:
-        t += step_size_ms
-        yield TcodeLine(
-            [
-                TcodeInstruction("L0", next(top_to_bottom), duration),
-                TcodeInstruction("L1", next(back_to_forth), duration),
-                TcodeInstruction(
-                    "R1",
-                    get_orbital_position(
-                        angular_speed_roll * t, roll_back, roll_forth, 1.5, -0.1
-                    ),
-                    duration,
-                ),
-                TcodeInstruction(
-                    "R2",
-                    get_orbital_position(
-                        angular_speed_pitch * t, pitch_back, pitch_forth, 1, -0.1
-                    ),
-                    duration,
-                ),
-                TcodeInstruction("A0", next(close_to_open), duration),
-            ]
-        )
-        duration = step_size_ms
+    return [
+        CycleAxis("L0", top_to_bottom),
+        CycleAxis("L1", back_to_forth),
+        OrbitalAxis("R1", angular_speed_roll, roll_back, roll_forth, 1.5, -0.1),
+        OrbitalAxis("R2", angular_speed_pitch, pitch_back, pitch_forth, 1, -0.1),
+        CycleAxis("A0", close_to_open),
+    ]
 
 
-def long_stroke_2(
+def long_stroke_1(
     relative_top, relative_bottom, relative_back, relative_forth, linear_speed
 ):
-    step_size_ms = 50
+    yield from sample_axes(
+        long_stroke_1_axes,
+        (relative_top, relative_bottom, relative_back, relative_forth, linear_speed),
+    )
+
+
+def long_stroke_2_axes(
+    relative_top, relative_bottom, relative_back, relative_forth, linear_speed
+):
+    step_size_ms = STEP_SIZE_MS
 
     # Stroke
     top = stroke_absolute_position(relative_top)
@@ -421,7 +563,7 @@ def long_stroke_2(
     stroke_increment = max([int(step_size_ms * linear_speed), 1])
     top_to_bottom = list(range(top, bottom - stroke_increment, -1 * stroke_increment))
     stroke_size = len(top_to_bottom)
-    top_to_bottom = cycle(top_to_bottom + list(reversed(top_to_bottom[0:-1])))
+    top_to_bottom = top_to_bottom + list(reversed(top_to_bottom[0:-1]))
 
     # Surge
     back = surge_absolute_position(relative_back)
@@ -431,7 +573,7 @@ def long_stroke_2(
     )
     surge_increment = max([surge_increment, 1])
     back_to_forth = list(range(forth, back - surge_increment, -1 * surge_increment))
-    back_to_forth = cycle(back_to_forth + list(reversed(back_to_forth[0:-1])))
+    back_to_forth = back_to_forth + list(reversed(back_to_forth[0:-1]))
 
     # valve
     valve_0 = valve_absolute_position(0)
@@ -444,7 +586,7 @@ def long_stroke_2(
     close_to_open = list(
         range(valve_100, max([valve_0 - valve_increment, 0]), -1 * valve_increment)
     )
-    close_to_open = cycle(close_to_open + list(reversed(close_to_open[0:-1])))
+    close_to_open = close_to_open + list(reversed(close_to_open[0:-1]))
 
     # pitch
     pitch_back = pitch_absolute_position(100)
@@ -457,38 +599,28 @@ def long_stroke_2(
     roll_forth = roll_absolute_position(0)
 
     angular_speed_roll = calculate_angular_velocity(abs(top - bottom), linear_speed)
-    t = 0
-    duration = INIT_TIME_DURATION_MS
-    while True:
-        t += step_size_ms
-        yield TcodeLine(
-            [
-                TcodeInstruction("L0", next(top_to_bottom), duration),
-                TcodeInstruction("L1", next(back_to_forth), duration),
-                TcodeInstruction(
-                    "R1",
-                    get_orbital_position(
-                        angular_speed_roll * t, roll_back, roll_forth, 1, -0.5
-                    ),
-                    duration,
-                ),
-                TcodeInstruction(
-                    "R2",
-                    get_orbital_position(
-                        angular_speed_pitch * t, pitch_back, pitch_forth, -1, -0.8
-                    ),
-                    duration,
-                ),
-                TcodeInstruction("A0", next(close_to_open), duration),
-            ]
-        )
-        duration = step_size_ms
+    return [
+        CycleAxis("L0", top_to_bottom),
+        CycleAxis("L1", back_to_forth),
+        OrbitalAxis("R1", angular_speed_roll, roll_back, roll_forth, 1, -0.5),
+        OrbitalAxis("R2", angular_speed_pitch, pitch_back, pitch_forth, -1, -0.8),
+        CycleAxis("A0", close_to_open),
+    ]
 
 
-def long_stroke_3(
+def long_stroke_2(
     relative_top, relative_bottom, relative_back, relative_forth, linear_speed
 ):
-    step_size_ms = 50
+    yield from sample_axes(
+        long_stroke_2_axes,
+        (relative_top, relative_bottom, relative_back, relative_forth, linear_speed),
+    )
+
+
+def long_stroke_3_axes(
+    relative_top, relative_bottom, relative_back, relative_forth, linear_speed
+):
+    step_size_ms = STEP_SIZE_MS
 
     # Stroke
     top = stroke_absolute_position(relative_top)
@@ -496,14 +628,14 @@ def long_stroke_3(
     stroke_increment = max([int(step_size_ms * linear_speed), 1])
     top_to_bottom = list(range(top, bottom - stroke_increment, -1 * stroke_increment))
     stroke_size = len(top_to_bottom)
-    top_to_bottom = cycle(top_to_bottom + list(reversed(top_to_bottom[0:-1])))
+    top_to_bottom = top_to_bottom + list(reversed(top_to_bottom[0:-1]))
 
     # Surge
     back = surge_absolute_position(relative_back)
     forth = surge_absolute_position(relative_forth)
     surge_increment = max([int(step_size_ms * linear_speed), 1])
     back_to_forth = list(range(forth, back - surge_increment, -1 * surge_increment))
-    back_to_forth = cycle(back_to_forth + list(reversed(back_to_forth[0:-1])))
+    back_to_forth = back_to_forth + list(reversed(back_to_forth[0:-1]))
     # valve
     valve_0 = valve_absolute_position(0)
     valve_100 = valve_absolute_position(100)
@@ -515,7 +647,7 @@ def long_stroke_3(
     close_to_open = list(
         range(valve_100, max([valve_0 - valve_increment, 0]), -1 * valve_increment)
     )
-    close_to_open = cycle(close_to_open + list(reversed(close_to_open[0:-1])))
+    close_to_open = close_to_open + list(reversed(close_to_open[0:-1]))
 
     # pitch
     pitch_back = pitch_absolute_position(100)
@@ -528,38 +660,28 @@ def long_stroke_3(
     roll_forth = roll_absolute_position(30)
 
     angular_speed_roll = calculate_angular_velocity(abs(top - bottom), linear_speed)
-    t = 0
-    duration = INIT_TIME_DURATION_MS
-    while True:
-        t += step_size_ms
-        yield TcodeLine(
-            [
-                TcodeInstruction("L0", next(top_to_bottom), duration),
-                TcodeInstruction("L1", next(back_to_forth), duration),
-                TcodeInstruction(
-                    "R1",
-                    get_orbital_position(
-                        angular_speed_roll * t, roll_back, roll_forth, 1.5, -0.1
-                    ),
-                    duration,
-                ),
-                TcodeInstruction(
-                    "R2",
-                    get_orbital_position(
-                        angular_speed_pitch * t, pitch_back, pitch_forth, 1, -0.1
-                    ),
-                    duration,
-                ),
-                TcodeInstruction("A0", next(close_to_open), duration),
-            ]
-        )
-        duration = step_size_ms
+    return [
+        CycleAxis("L0", top_to_bottom),
+        CycleAxis("L1", back_to_forth),
+        OrbitalAxis("R1", angular_speed_roll, roll_back, roll_forth, 1.5, -0.1),
+        OrbitalAxis("R2", angular_speed_pitch, pitch_back, pitch_forth, 1, -0.1),
+        CycleAxis("A0", close_to_open),
+    ]
 
 
-def long_stroke_4(
+def long_stroke_3(
+    relative_top, relative_bottom, relative_back, relative_forth, linear_speed
+):
+    yield from sample_axes(
+        long_stroke_3_axes,
+        (relative_top, relative_bottom, relative_back, relative_forth, linear_speed),
+    )
+
+
+def long_stroke_4_axes(
     relative_top, relative_bottom, relative_back, relative_forth, linear_speed
 ):
-    step_size_ms = 50
+    step_size_ms = STEP_SIZE_MS
 
     # Stroke
     top = stroke_absolute_position(relative_top)
@@ -567,7 +689,7 @@ def long_stroke_4(
     stroke_increment = max([int(step_size_ms * linear_speed), 1])
     top_to_bottom = list(range(top, bottom - stroke_increment, -1 * stroke_increment))
     stroke_size = len(top_to_bottom)
-    top_to_bottom = cycle(top_to_bottom + list(reversed(top_to_bottom[0:-1])))
+    top_to_bottom = top_to_bottom + list(reversed(top_to_bottom[0:-1]))
 
     # Surge
     # Surge
@@ -578,7 +700,7 @@ def long_stroke_4(
     )
     surge_increment = max([surge_increment, 1])
     back_to_forth = list(range(forth, back - surge_increment, -1 * surge_increment))
-    back_to_forth = cycle(back_to_forth + list(reversed(back_to_forth[0:-1])))
+    back_to_forth = back_to_forth + list(reversed(back_to_forth[0:-1]))
     # valve
     valve_0 = valve_absolute_position(0)
     valve_100 = valve_absolute_position(100)
@@ -590,7 +712,7 @@ def long_stroke_4(
     close_to_open = list(
         range(valve_100, max([valve_0 - valve_increment, 0]), -1 * valve_increment)
     )
-    close_to_open = cycle(close_to_open + list(reversed(close_to_open[0:-1])))
+    close_to_open = close_to_open + list(reversed(close_to_open[0:-1]))
 
     # pitch
     pitch_back = pitch_absolute_position(100)
@@ -603,32 +725,67 @@ def long_stroke_4(
     roll_forth = roll_absolute_position(30)
 
     angular_speed_roll = calculate_angular_velocity(abs(top - bottom), linear_speed)
-    t = 0
-    duration = INIT_TIME_DURATION_MS
-    while True:
-        t += step_size_ms
-        yield TcodeLine(
-            [
-                TcodeInstruction("L0", next(top_to_bottom), duration),
-                TcodeInstruction("L1", next(back_to_forth), duration),
-                TcodeInstruction(
-                    "R1",
-                    get_orbital_position(
-                        angular_speed_roll * t, roll_back, roll_forth, 1.5, 0.5
-                    ),
-                    duration,
-                ),
-                TcodeInstruction(
-                    "R2",
-                    get_orbital_position(
-                        angular_speed_pitch * t, pitch_back, pitch_forth, 0.5, 1
-                    ),
-                    duration,
-                ),
-                TcodeInstruction("A0", next(close_to_open), duration),
-            ]
+    return [
+        CycleAxis("L0", top_to_bottom),
+        CycleAxis("L1", back_to_forth),
+        OrbitalAxis("R1", angular_speed_roll, roll_back, roll_forth, 1.5, 0.5),
+        OrbitalAxis("R2", angular_speed_pitch, pitch_back, pitch_forth, 0.5, 1),
+        CycleAxis("A0", close_to_open),
+    ]
+
+
+def long_stroke_4(
+    relative_top, relative_bottom, relative_back, relative_forth, linear_speed
+):
+    yield from sample_axes(
+        long_stroke_4_axes,
+        (relative_top, relative_bottom, relative_back, relative_forth, linear_speed),
+    )
+
+
+PATTERN_AXES = {
+    "full_stroke_with_roll_motion": full_stroke_with_roll_motion_axes,
+    "full_stroke_with_pitch_motion": full_stroke_with_pitch_motion_axes,
+    "wild_stroke_and_pitch": wild_stroke_and_pitch_axes,
+    "long_stroke_1": long_stroke_1_axes,
+    "long_stroke_2": long_stroke_2_axes,
+    "long_stroke_3": long_stroke_3_axes,
+    "long_stroke_4": long_stroke_4_axes,
+}
+
+
+def render_pattern_block(
+    pattern,
+    relative_top,
+    relative_bottom,
+    relative_back,
+    relative_forth,
+    linear_speed,
+    start=0,
+    count=BLOCK_STEPS,
+) -> PatternBlock:
+    """Batch version of the sampled patterns, `pattern` is the generator function."""
+    axes = PATTERN_AXES[pattern.__name__](
+        relative_top, relative_bottom, relative_back, relative_forth, linear_speed
+    )
+    return render_block(axes, start, count)
+
+
+def prerender_blocks(name, parameters, blocks, step_size_ms=STEP_SIZE_MS) -> list:
+    """The first `blocks` blocks of a sampled pattern as (cache key, TcodeBlock) pairs.
+
+    `parameters` have to be quantized by the cache the blocks are meant for.
+    """
+    build_axes = PATTERN_AXES[name]
+    axes = build_axes(*parameters)
+    cache_key = block_cache_key(build_axes, parameters, step_size_ms)
+    return [
+        (
+            cache_key + (start,),
+            render_block(axes, start, BLOCK_STEPS, step_size_ms).to_tcode_block(),
         )
-        duration = step_size_ms
+        for start in range(0, blocks * BLOCK_STEPS, BLOCK_STEPS)
+    ]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+import threading
+from bisect import bisect_left
+from inspect import GEN_CREATED, getgeneratorstate
+from itertools import chain
+
+from keyframes import compress_keyframes
+
+# a pattern keeps playing for this long without a new state from the game
+RENDER_HORIZON_MS = 1000 * 60 * 1.2
+# line starts the device is past are dropped in batches of at least this many
+TRIM_STARTS = 1024
+
+
+class PatternProducer(threading.Thread):
+    """Pulls lines from the current pattern generator into a TcodeFire.
+
+    The generator is advanced lazily on this thread, so the proxy only
+    swaps the pattern and never renders motion itself. The lookahead is
+    bounded by the TcodeFire queue, pushing blocks while it is full.
+
+    `retarget` hands new parameters to the running generator instead of
+    starting over. The lines queued in TcodeFire are dropped and the
+    generator continues from the step the device is at, see `sample_axes`.
+    """
+
+    def __init__(
+        self, tcode_fire, horizon_ms=RENDER_HORIZON_MS, keyframe_tolerance=None
+    ) -> None:
+        super().__init__(daemon=True)
+        self._tcode_fire = tcode_fire
+        self._horizon_ms = horizon_ms
+        self._pattern_horizon_ms = horizon_ms
+        # when set, patterns go through compress_keyframes on their way to the device
+        self._keyframe_tolerance = keyframe_tolerance
+        # the generator as passed in, and what is actually pulled from it
+        self._source = None
+        self._pattern = None
+        # session ms at which each pulled source line starts, from step _start_step on
+        self._starts = []
+        self._start_step = 0
+        self._retarget = None
+        self._generation = None
+        self._rendered_ms = 0
+        self._condition = threading.Condition()
+        self._mode = "running"
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def playing(self):
+        """True while the current pattern is still being pushed."""
+        return self._pattern is not None or self._retarget is not None
+
+    def set_pattern(self, pattern, horizon_ms=None) -> int:
+        """Drops whatever is queued and starts feeding `pattern` (None halts).
+
+        `horizon_ms` overrides how long it plays, `math.inf` plays it to
+        its end. Returns the generation of the new TcodeFire session.
+        """
+        with self._condition:
+            self._generation = self._tcode_fire.clear()
+            self._pattern_horizon_ms = self._horizon_ms if horizon_ms is None else horizon_ms
+            self._source = pattern
+            self._retarget = None
+            self._follow(pattern, 0, 0)
+            self._condition.notify()
+            return self._generation
+
+    def retarget(self, **update) -> bool:
+        """Sends `update` (see `patterns.PARAMETERS`) to the running pattern.
+
+        Returns False if there is no pattern to retarget.
+        """
+        with self._condition:
+            if self._source is None:
+                return False
+            self._generation, consumed_ms = self._tcode_fire.flush()
+            if self._retarget is not None:  # not picked up yet, merge them
+                update = dict(self._retarget[0], **update)
+            self._retarget = (update, consumed_ms)
+            self._condition.notify()
+            return True
+
+    def _follow(self, lines, start_step, start_ms):
+        """Makes `lines` the stream to push, its first line being `start_step`."""
+        self._starts = []
+        self._start_step = start_step
+        self._rendered_ms = 0
+        if lines is None:
+            self._pattern = None
+            return
+        lines = self._track(lines, self._starts, start_ms)
+        if self._keyframe_tolerance is not None:
+            lines = compress_keyframes(lines, self._keyframe_tolerance)
+        self._pattern = lines
+
+    @staticmethod
+    def _track(lines, starts, start_ms):
+        for line in lines:
+            starts.append(start_ms)
+            start_ms += line.duration_ms
+            yield line
+
+    def _trim_starts(self):
+        # a retarget never goes back before what was sent, played to its end
+        # (horizon_ms=math.inf) the starts would otherwise pile up
+        played = bisect_left(self._starts, self._tcode_fire.sent_ms)
+        if played >= TRIM_STARTS:
+            del self._starts[:played]
+            self._start_step += played
+
+    def _apply_retarget(self, source, update, consumed_ms):
+        # the first line the device has not started on yet
+        step = self._start_step + bisect_left(self._starts, consumed_ms)
+        try:
+            if getgeneratorstate(source) == GEN_CREATED:
+                next(source)
+            first = source.send(dict(update, step=step))
+        except StopIteration:  # retargeted past its end
+            first = None
+        except Exception as e:
+            print("pattern failed -", e)
+            first = None
+        with self._condition:
+            if self._source is not source:  # replaced meanwhile
+                return
+            if first is None:
+                self._source = None
+                self._follow(None, 0, 0)
+            else:
+                self._follow(chain([first], source), step, consumed_ms)
+
+    def stop_thread(self):
+        with self._condition:
+            self._mode = "stop"
+            self._condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                while (
+                    self._mode == "running"
+                    and self._pattern is None
+                    and self._retarget is None
+                ):
+                    self._condition.wait()
+                if self._mode != "running":
+                    return
+                retarget, self._retarget = self._retarget, None
+                source, pattern, generation = self._source, self._pattern, self._generation
+            if retarget is not None:
+                self._apply_retarget(source, *retarget)
+                continue
+
+            try:
+                line = next(pattern)
+            except StopIteration:  # played to its end
+                line = None
+            except Exception as e:
+                print("pattern failed -", e)
+                line = None
+            if line is None:
+                with self._condition:
+                    if self._pattern is pattern:
+                        self._source = None
+                        self._pattern = None
+                continue
+            # blocks while the queue is full, gives up once the session changed
+            if not self._tcode_fire.push_instruction(line, generation):
+                continue
+            with self._condition:
+                if self._pattern is pattern:
+                    self._trim_starts()
+                    self._rendered_ms += line.duration_ms
+                    if self._rendered_ms >= self._pattern_horizon_ms:
+                        self._pattern = None
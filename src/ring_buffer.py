@@ -0,0 +1,91 @@
+import threading
+
+
+class RingBuffer:
+    """Bounded single-producer/single-consumer queue.
+
+    `push` blocks while the buffer is full and `pop` blocks while it is
+    empty, so neither side spins. Every `replace` starts a new generation;
+    pushes tagged with an older generation are dropped, which lets a
+    producer that was blocked on a full buffer notice a session change.
+    """
+
+    def __init__(self, capacity) -> None:
+        self._capacity = capacity
+        self._slots = [None] * capacity
+        self._head = 0
+        self._size = 0
+        self._generation = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def push(self, item, generation=None, timeout=None) -> bool:
+        """Appends `item`, waiting for room. Returns False if it was dropped."""
+        with self._not_full:
+            while True:
+                if self._closed:
+                    return False
+                if generation is not None and generation != self._generation:
+                    return False
+                if self._size < self._capacity:
+                    break
+                if not self._not_full.wait(timeout):
+                    return False
+            self._slots[(self._head + self._size) % self._capacity] = item
+            self._size += 1
+            self._not_empty.notify()
+            return True
+
+    def pop(self, timeout=None):
+        """Returns `(generation, item)`, or None when closed or timed out."""
+        with self._not_empty:
+            while self._size == 0:
+                if self._closed:
+                    return None
+                if not self._not_empty.wait(timeout):
+                    return None
+            item = self._slots[self._head]
+            self._slots[self._head] = None
+            self._head = (self._head + 1) % self._capacity
+            self._size -= 1
+            self._not_full.notify()
+            return self._generation, item
+
+    def peek(self):
+        """Returns `(generation, item)` of the next item without removing it, or None."""
+        with self._lock:
+            if self._size == 0:
+                return None
+            return self._generation, self._slots[self._head]
+
+    def replace(self, items=()) -> int:
+        """Atomically swaps the queued items for `items` and starts a new generation."""
+        items = list(items)[: self._capacity]
+        with self._lock:
+            self._slots = items + [None] * (self._capacity - len(items))
+            self._head = 0
+            self._size = len(items)
+            self._generation += 1
+            self._not_full.notify_all()
+            if self._size:
+                self._not_empty.notify()
+            return self._generation
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._not_full.notify_all()
+            self._not_empty.notify_all()
+
+    def __len__(self):
+        return self._size
@@ -0,0 +1,113 @@
+import math
+import sys
+import time
+
+# block on the session condition until this close to a deadline
+# (windows timers only wake up every ~15.6 ms)
+WAIT_MARGIN_S = 0.016 if sys.platform == "win32" else 0.002
+# then sleep, and spin the last stretch with the GIL released
+SPIN_MARGIN_S = 0.001
+# if a line could not leave on time (queue underrun), start a fresh timeline
+RESYNC_AFTER_MS = 100
+
+
+class JitterStats:
+    """Running statistics of how late lines leave compared to their deadline."""
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self):
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+        self._over_1ms = 0
+
+    def add(self, error_ms):
+        self._count += 1
+        delta = error_ms - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (error_ms - self._mean)
+        self._min = min(self._min, error_ms)
+        self._max = max(self._max, error_ms)
+        if abs(error_ms) >= 1:
+            self._over_1ms += 1
+
+    def snapshot(self) -> dict:
+        if self._count == 0:
+            return {"count": 0}
+        return {
+            "count": self._count,
+            "mean_ms": self._mean,
+            "stdev_ms": math.sqrt(self._m2 / self._count),
+            "min_ms": self._min,
+            "max_ms": self._max,
+            "over_1ms": self._over_1ms,
+        }
+
+
+class DeadlineScheduler:
+    """Fires lines at absolute deadlines: session start plus the summed durations.
+
+    Errors do not add up from line to line, a late line only delays
+    itself and the following one is still due on the original grid.
+
+    Deadlines are when a line should reach the device, lines leave
+    `lead_s` earlier to make up for the way there (see feedback.py).
+    """
+
+    def __init__(
+        self,
+        wait_margin_s=WAIT_MARGIN_S,
+        spin_margin_s=SPIN_MARGIN_S,
+        resync_after_ms=RESYNC_AFTER_MS,
+    ) -> None:
+        self._wait_margin_s = wait_margin_s
+        self._spin_margin_s = spin_margin_s
+        self._resync_after_s = resync_after_ms / 1000
+        self._next_deadline = None
+        self.lead_s = 0
+        self.stats = JitterStats()
+        self.resyncs = 0
+
+    @property
+    def next_deadline(self):
+        return self._next_deadline
+
+    def start(self):
+        """Anchors a new timeline, the next line leaves right away."""
+        self._next_deadline = time.perf_counter() + self.lead_s
+
+    def wait(self, interruptible_wait) -> bool:
+        """Waits until the next deadline.
+
+        `interruptible_wait(timeout_s)` does the coarse part of the wait and
+        returns True if it was interrupted, in which case this returns False.
+        """
+        now = time.perf_counter()
+        if (
+            self._next_deadline is None
+            or now - (self._next_deadline - self.lead_s) > self._resync_after_s
+        ):
+            if self._next_deadline is not None:
+                self.resyncs += 1
+            self._next_deadline = now + self.lead_s
+            return True
+        deadline = self._next_deadline - self.lead_s
+        remaining = deadline - now
+        if remaining > self._wait_margin_s:
+            if interruptible_wait(remaining - self._wait_margin_s):
+                return False
+        remaining = deadline - time.perf_counter()
+        if remaining > self._spin_margin_s:
+            time.sleep(remaining - self._spin_margin_s)
+        while time.perf_counter() < deadline:
+            time.sleep(0)
+        return True
+
+    def fired(self, duration_ms, fired_at):
+        """Records when the line went out and moves on to the next deadline."""
+        self.stats.add((fired_at + self.lead_s - self._next_deadline) * 1000)
+        self._next_deadline += duration_ms / 1000
@@ -1,34 +1,25 @@
 import threading
 import time
-import uuid
-import serial
+from array import array
 
 from configuration import configuration
+from ring_buffer import RingBuffer
+from scheduler import DeadlineScheduler
+from transports import open_transport
 
+# lines waiting ahead of the device, this is also the producer lookahead
+QUEUE_SIZE = 20
+# how far (in position units) a merged write-ahead move may stray from the samples
+WRITE_AHEAD_TOLERANCE = 1
 
-class MockSerial:
-    def __init__(self, com, baud_Rate) -> None:
-        pass
 
-    def flushInput(self):
-        pass
-
-    def write(self, encoded_string):
-        print(
-            f"{int(time.monotonic() * 1000)}, {encoded_string.decode('utf-8').strip()}"
-        )
-
-    def close(self):
-        pass
-
-
-# for debug purpose...
+# for debug purpose, serial ports print their lines instead
 debug = configuration["COM"]["debug"]
-if debug == True:
-    serial.Serial = MockSerial
 
 
 class TcodeInstruction:
+    __slots__ = ("_axis", "_value", "_duration_ms")
+
     def __init__(
         self,
         axis,
@@ -39,90 +30,477 @@ class TcodeInstruction:
         self._value = value
         self._duration_ms = duration_ms
 
+    @classmethod
+    def parse(cls, token: str):
+        """Parses a single `L050I50` command."""
+        value, _, duration_ms = token[2:].partition("I")
+        return cls(token[:2], int(value), int(duration_ms or 0))
+
     def __str__(self) -> str:
         return f"{self._axis}{self._value:02d}I{self._duration_ms}"
 
+    @property
+    def axis(self):
+        return self._axis
+
+    @property
+    def value(self):
+        return self._value
+
     @property
     def duration_ms(self):
         return self._duration_ms
 
 
 class TcodeLine:
-    def __init__(self, instructions: list[TcodeInstruction]) -> None:
-        self._instructions = instructions
+    """One serial line, encoded and timed once when it is built."""
+
+    __slots__ = ("_instructions", "_encoded", "_duration_ms")
+
+    def __init__(self, instructions: list[TcodeInstruction], duration_ms=None) -> None:
+        """`duration_ms` is how long until the next line, the longest interval by default."""
+        self._instructions = tuple(instructions)
+        self._encoded = (
+            " ".join(str(i) for i in self._instructions) + "\n"
+        ).encode()
+        if duration_ms is None:
+            duration_ms = max((i.duration_ms for i in self._instructions), default=0)
+        self._duration_ms = duration_ms
+
+    @classmethod
+    def from_encoded(cls, encoded: bytes, duration_ms: int):
+        """Wraps an already encoded line, the instructions are parsed on demand."""
+        line = cls.__new__(cls)
+        line._instructions = None
+        line._encoded = encoded
+        line._duration_ms = duration_ms
+        return line
+
+    @property
+    def instructions(self) -> tuple:
+        if self._instructions is None:
+            self._instructions = tuple(
+                TcodeInstruction.parse(token) for token in self._encoded.decode().split()
+            )
+        return self._instructions
 
     def __str__(self) -> str:
-        return " ".join(str(i) for i in self._instructions) + "\n"
+        return self._encoded.decode()
 
     def strip(self):
         return str(self).strip()
 
     def encode(self):
-        return str(self).encode()
+        return self._encoded
 
     @property
     def duration_ms(self):
-        return max([s.duration_ms for s in self._instructions])
+        return self._duration_ms
+
+
+class TcodeBlock:
+    """Many lines in contiguous storage instead of one object per line.
+
+    The encoded lines share a single bytearray, line `i` spans
+    `offsets[i]:offsets[i + 1]` and lasts `durations[i]` ms.
+    """
+
+    __slots__ = ("_encoded", "_offsets", "_durations")
+
+    def __init__(self) -> None:
+        self._encoded = bytearray()
+        self._offsets = array("I", [0])
+        self._durations = array("I")
+
+    @classmethod
+    def from_lines(cls, lines):
+        block = cls()
+        for line in lines:
+            block.append(line.encode(), line.duration_ms)
+        return block
+
+    def append(self, encoded: bytes, duration_ms: int):
+        self._encoded += encoded
+        self._offsets.append(len(self._encoded))
+        self._durations.append(duration_ms)
+
+    def encoded(self, index) -> bytes:
+        return bytes(self._encoded[self._offsets[index] : self._offsets[index + 1]])
+
+    def duration_ms(self, index) -> int:
+        return self._durations[index]
+
+    @property
+    def total_duration_ms(self):
+        return sum(self._durations)
+
+    @property
+    def nbytes(self):
+        return (
+            len(self._encoded)
+            + self._offsets.itemsize * len(self._offsets)
+            + self._durations.itemsize * len(self._durations)
+        )
+
+    def __len__(self):
+        return len(self._durations)
+
+    def __getitem__(self, index) -> TcodeLine:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("block index out of range")
+        return TcodeLine.from_encoded(self.encoded(index), self._durations[index])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def extends_linearly(start, group, line, tolerance=WRITE_AHEAD_TOLERANCE) -> bool:
+    """True if `group + [line]` can go out as one move from the `start` targets.
+
+    The firmware interpolates linearly over an `I` interval, so the lines
+    can only be merged if every sample they skip lies on that straight
+    path (within `tolerance`) and they all last the same time.
+    """
+    lines = group + [line]
+    axes = [i.axis for i in group[0].instructions]
+    rows = []
+    for candidate in lines:
+        instructions = candidate.instructions
+        if [i.axis for i in instructions] != axes:
+            return False
+        if any(i.duration_ms != group[0].duration_ms for i in instructions):
+            return False
+        rows.append([i.value for i in instructions])
+    if any(axis not in start for axis in axes):
+        return False
+    origin = [start[axis] for axis in axes]
+    for k, row in enumerate(rows[:-1], 1):
+        for a, value in enumerate(row):
+            expected = origin[a] + (rows[-1][a] - origin[a]) * k / len(rows)
+            if abs(value - expected) > tolerance:
+                return False
+    return True
+
+
+def scale_line(line, rate) -> TcodeLine:
+    """The same moves played `rate` times as fast."""
+    return TcodeLine(
+        [
+            TcodeInstruction(i.axis, i.value, round(i.duration_ms / rate))
+            for i in line.instructions
+        ],
+        round(line.duration_ms / rate),
+    )
+
+
+def merge_lines(lines) -> TcodeLine:
+    """One line that moves every axis to its last target, arriving when the lines would have.
+
+    It lasts the summed interval. Axes left out of the last line (keyframes)
+    keep their own last target and arrival.
+    """
+    targets = {}
+    offset_ms = 0
+    for line in lines:
+        for i in line.instructions:
+            targets[i.axis] = TcodeInstruction(i.axis, i.value, offset_ms + i.duration_ms)
+        offset_ms += line.duration_ms
+    return TcodeLine(list(targets.values()), offset_ms)
 
 
 class TcodeFire(threading.Thread):
-    def __init__(self, com, baud_rate, *args, **kwarg) -> None:
+    def __init__(
+        self,
+        com,
+        baud_rate,
+        *args,
+        queue_size=QUEUE_SIZE,
+        write_ahead_ms=0,
+        delta_encoder=None,
+        range_map=None,
+        on_first_write=None,
+        transport=None,
+        feedback=None,
+        link_budget=None,
+        **kwarg,
+    ) -> None:
         super().__init__()
-        self._queue = []
+        self._queue = RingBuffer(queue_size)
+        self._generation = self._queue.generation
+        # the generation of the last clear, flushes keep the session running
+        self._session = self._generation
         self._mode = "running"
-        self._serial_channel = None
+        # opened from `com` by start_thread unless one is passed in, see transports.py
+        self._transport = transport
         self._com = com
         self._baud_rate = baud_rate
-        self._session_id = str(uuid.uuid4())
+        self._session_condition = threading.Condition()
+        self._scheduler = DeadlineScheduler()
+        self._scheduled_session = None
+        # duration of the lines sent (or about to be) since the session started
+        self._session_ms = 0
+        self._written_generation = None
+        # merge upcoming lines into one write as long as they fit in this budget
+        self._write_ahead_ms = write_ahead_ms
+        # lines are played this many times as fast as they were rendered
+        self._rate = 1.0
+        self._last_targets = {}
+        self._lines_written = 0
+        self._writes = 0
+        # optional DeltaEncoder that leaves out commands the device does not need
+        self._delta_encoder = delta_encoder
+        # set by the transport's (re)connects, the encoder starts over on the next line
+        self._reconnected = False
+        # optional RangeMap into this device's ranges, applied right before encoding
+        self._range_map = range_map
+        # called with (generation, perf_counter time) once a generation's first line is out
+        self._on_first_write = on_first_write
+        # optional DeviceFeedback, reads the device and sets how far ahead lines are sent
+        self._feedback = feedback
+        # optional LinkBudget, lines that would overrun the link are merged into longer moves
+        self._link_budget = link_budget
 
-    def push_instruction(self, instruction: TcodeLine):
-        self._queue.append(instruction)
+    def push_instruction(self, instruction: TcodeLine, generation=None) -> bool:
+        """Queues a line, blocking while the queue is full.
+
+        Returns False if the line belongs to a session that was cleared
+        in the meantime.
+        """
+        return self._queue.push(instruction, generation)
 
     def push_instructions(self, *instruction):
-        self._queue.extend(instruction)
+        for i in instruction:
+            self._queue.push(i)
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def set_rate(self, rate):
+        """Plays the queued and upcoming lines `rate` times as fast, from the next line on.
 
-    def clear(self):
-        self._queue.clear()
-        self._session_id = str(uuid.uuid4())
+        Only the intervals and the step grid change, not the positions. A
+        clear or flush sets the rate back to 1, lines pushed after it are
+        expected to be rendered at the speed wanted.
+        """
+        self._rate = rate
+
+    def clear(self) -> int:
+        """Drops every queued line and starts a new session, returns its generation."""
+        with self._session_condition:
+            self._generation = self._queue.replace()
+            self._session = self._generation
+            self._rate = 1.0
+            self._session_condition.notify_all()
+        return self._generation
+
+    def flush(self) -> tuple:
+        """Drops every queued line but keeps the session's timeline going.
+
+        The line waiting for its deadline is dropped as well, the next
+        pushed line takes its slot. Returns the new generation and how many
+        ms of the session were sent, which is where that line will start.
+        """
+        with self._session_condition:
+            self._generation = self._queue.replace()
+            self._rate = 1.0
+            self._session_condition.notify_all()
+            return self._generation, self._sent_ms()
+
+    @property
+    def sent_ms(self):
+        """How many ms of the current session were sent (or are about to be)."""
+        with self._session_condition:
+            return self._sent_ms()
+
+    def _sent_ms(self):
+        # 0 until the session's first line is taken on
+        if self._scheduled_session != self._session:
+            return 0
+        return self._session_ms
 
     def stop_thread(self):
-        self._serial_channel.close()
         self._mode = "stop"
+        self._queue.close()
+        with self._session_condition:
+            self._session_condition.notify_all()
+        self._transport.close()
 
     def start_thread(self):
         self._mode = "running"
-        self._serial_channel = serial.Serial(self._com, self._baud_rate)  # COM, 115200)
-        self._serial_channel.flushInput()
-        # self._serial_channel.write("L005I2000".encode())
+        if self._transport is None:
+            feedback = self._feedback
+            self._transport = open_transport(
+                self._com,
+                self._baud_rate,
+                debug=debug,
+                on_line=feedback.receive if feedback is not None else None,
+                on_connect=self._on_connect,
+            )
+        if self._feedback is not None:
+            self._feedback.attach(self._transport)
+        # self._transport.write("L005I2000".encode())
         # time.sleep(2.5)
         self.start()
 
-    def delay(self, time_ms):
-        current_session_id = self._session_id
-        end_time_ms = int(time.monotonic() * 1000) + time_ms
-        while (
-            int(time.monotonic() * 1000) < end_time_ms
-            and current_session_id == self._session_id
-        ):
-            time.sleep(0.01)
-            # pass
+    def _on_connect(self, transport):
+        # lines may have been lost with the connection, what the device
+        # holds is not what the encoder thinks anymore
+        self._reconnected = True
+        if self._feedback is not None:
+            self._feedback.identify(transport)
+
+    @property
+    def transport(self):
+        return self._transport
 
+    @property
+    def lead_ms(self):
+        """How far ahead of their deadline lines are sent, the device's measured latency."""
+        return self._scheduler.lead_s * 1000
+
+    def _wait_for_clear(self, generation, timeout_s) -> bool:
+        """Sleeps up to `timeout_s`, returns True if the queue was cleared meanwhile."""
+        with self._session_condition:
+            return self._session_condition.wait_for(
+                lambda: generation != self._generation or self._mode != "running",
+                timeout_s,
+            )
+
+    def jitter_stats(self) -> dict:
+        stats = self._scheduler.stats.snapshot()
+        stats["resyncs"] = self._scheduler.resyncs
+        return stats
+
+    def write_stats(self) -> dict:
+        stats = {"lines": self._lines_written, "writes": self._writes}
+        if self._delta_encoder is not None:
+            stats["dropped_commands"] = self._delta_encoder.dropped
+        stats["transport"] = self._transport.stats() if self._transport is not None else {}
+        if self._link_budget is not None:
+            stats["link"] = self._link_budget.stats()
+        return stats
+
+    def feedback_stats(self) -> dict:
+        return self._feedback.stats() if self._feedback is not None else {}
+
+    def _write_ahead(self, line, generation) -> list:
+        """Takes the queued lines that can ride along with `line` in one write."""
+        group = [line]
+        duration_ms = line.duration_ms
+        while True:
+            peeked = self._queue.peek()
+            if peeked is None or peeked[0] != generation:
+                break
+            candidate = peeked[1]
+            if duration_ms + candidate.duration_ms > self._write_ahead_ms * self._rate:
+                break
+            if not extends_linearly(self._last_targets, group, candidate):
+                break
+            if self._queue.pop(timeout=0) != peeked:
+                break
+            group.append(candidate)
+            duration_ms += candidate.duration_ms
+        return group
+
+    def _fit_budget(self, group, generation, rate) -> list:
+        """Takes queued lines into `group` until the link can carry it before the next write.
+
+        Every line taken is one sample less, the group goes out as one
+        longer move instead of queuing up behind the link.
+        """
+        now = time.perf_counter()
+        # the merged line has the axes of the last one, near enough for the estimate
+        nbytes = len(group[-1].encode())
+        duration_ms = sum(line.duration_ms for line in group)
+        merged = 0
+        while not self._link_budget.fits(nbytes, duration_ms / rate / 1000, now):
+            peeked = self._queue.peek()
+            if peeked is None or peeked[0] != generation:
+                break
+            if self._queue.pop(timeout=0) != peeked:
+                break
+            group.append(peeked[1])
+            duration_ms += peeked[1].duration_ms
+            merged += 1
+        if merged:
+            self._link_budget.merged(merged)
+        return group
 
     def run(self) -> None:
         while self._mode == "running":
-
-            if len(self._queue) != 0:
-                instruction = self._queue.pop(0)
-                s = int(time.monotonic() * 1000)
-                # self._serial_channel.write()
-                self._serial_channel.write(instruction.encode())
-                e = int(time.monotonic() * 1000)
-                delay_for = instruction.duration_ms - (e - s)
-                try:
-                    # time.sleep((delay_for * 0.99) / 1000)
-                    self.delay(delay_for)
-                except ValueError:
-                    pass
+            popped = self._queue.pop()
+            if popped is None:  # closed
+                break
+            generation, instruction = popped
+            with self._session_condition:
+                if generation < self._generation:  # cleared while we were waiting
+                    continue
+                session = self._session
+                first_line = session != self._scheduled_session
+                if first_line:
+                    self._scheduled_session = session
+                    self._session_ms = 0
+            if self._feedback is not None:
+                self._scheduler.lead_s = self._feedback.lead_ms / 1000
+            if first_line:
+                self._scheduler.start()
+                self._last_targets = {}
+                if self._delta_encoder is not None:
+                    self._delta_encoder.reset()
+            if not self._scheduler.wait(
+                lambda timeout_s: self._wait_for_clear(generation, timeout_s)
+            ):
+                continue
+            with self._session_condition:
+                if generation != self._generation:  # flushed during the last spin
+                    continue
+                rate = self._rate
+                group = [instruction]
+                if self._write_ahead_ms:
+                    group = self._write_ahead(instruction, generation)
+                if self._link_budget is not None:
+                    group = self._fit_budget(group, generation, rate)
+                self._session_ms += sum(line.duration_ms for line in group)
+            lines_written = len(group)
+            if lines_written > 1:
+                instruction = merge_lines(group)
+            duration_ms = instruction.duration_ms / rate
+            if rate != 1.0:
+                instruction = scale_line(instruction, rate)
+            # write-ahead compares with queued lines, it keeps the rendered targets
+            written = instruction
+            if self._range_map is not None:
+                written = self._range_map.remap(instruction)
+            if self._delta_encoder is not None:
+                if self._reconnected:
+                    self._reconnected = False
+                    self._delta_encoder.reset()
+                encoded = self._delta_encoder.encode(written)
+            else:
+                encoded = written.encode()
+            fired_at = time.perf_counter()
+            if encoded:
+                self._transport.write(encoded)
+                self._writes += 1
+                if self._link_budget is not None:
+                    self._link_budget.written(len(encoded), fired_at)
+            self._scheduler.fired(duration_ms, fired_at)
+            if self._feedback is not None:
+                # after the line, a probe never holds one up
+                self._feedback.probe(fired_at)
+            self._lines_written += lines_written
+            if generation != self._written_generation:
+                self._written_generation = generation
+                if self._on_first_write is not None:
+                    self._on_first_write(generation, fired_at)
+            if self._write_ahead_ms:
+                self._last_targets.update(
+                    (i.axis, i.value) for i in instruction.instructions
+                )
 
     def __len__(self):
         return len(self._queue)
@@ -0,0 +1,433 @@
+"""Where TcodeFire's lines go, picked by `open_transport` from the port in config.yaml:
+
+    COM6, /dev/ttyUSB0, loop://   serial port, anything pyserial's serial_for_url opens
+    tcp://host:port               raw TCP stream
+    udp://host:port               one datagram per line
+    ws://host:port/path           WebSocket text messages, for MultiFunPlayer or a simulator
+    capture://                    kept in memory, see CaptureTransport
+    print://                      printed with a timestamp, what `COM.debug` makes of serial ports
+
+Serial ports are written on the caller's thread, so TcodeFire's
+timestamps are when the bytes reached the port. The network transports
+queue to a writer thread of their own, as connecting or a full socket
+buffer could hold a line up for seconds.
+
+A transport opened with `on_line` also reads what the device sends
+back, on a thread of its own, and hands it over one line at a time.
+`on_connect` is called with the transport after every (re)connect.
+"""
+import select
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import serial
+
+# lines held while the peer is away, the oldest go first as stale motion is no use
+MAX_PENDING_WRITES = 64
+RECONNECT_MIN_S = 0.1
+RECONNECT_MAX_S = 5.0
+CONNECT_TIMEOUT_S = 2.0
+WRITE_TIMEOUT_S = 1.0
+# how often a reader with nothing to read checks whether the transport was closed
+READ_TIMEOUT_S = 0.5
+RECEIVE_BYTES = 4096
+
+
+class Transport:
+    """Takes encoded lines from TcodeFire, `write` must never block for long."""
+
+    # called with (line, perf_counter time) for each line the device sends, None if not read
+    on_line = None
+    on_connect = None
+    _running = True
+
+    def write(self, data: bytes):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+    def _receive(self, connection):
+        """Bytes the device sent, None if nothing came within READ_TIMEOUT_S, b"" once closed."""
+        raise NotImplementedError
+
+    def _read_lines(self, connection):
+        """Hands what the device sends to `on_line` until the connection goes away."""
+        buffered = b""
+        while self._running:
+            try:
+                data = self._receive(connection)
+            except Exception:
+                return
+            if data is None:
+                continue
+            if not data:
+                return
+            received_at = time.perf_counter()
+            *lines, buffered = (buffered + data).split(b"\n")
+            for line in lines:
+                line = line.strip()
+                if line:
+                    self.on_line(line, received_at)
+
+    def _connected(self, connection):
+        if self.on_line is not None:
+            threading.Thread(target=self._read_lines, args=(connection,), daemon=True).start()
+        if self.on_connect is not None:
+            self.on_connect(self)
+
+
+class PrintTransport(Transport):
+    def write(self, data: bytes):
+        print(f"{int(time.monotonic() * 1000)}, {data.decode('utf-8').strip()}")
+
+
+class CaptureTransport(Transport):
+    """Keeps every write as `(perf_counter time, bytes)` in `writes`."""
+
+    def __init__(self) -> None:
+        self.writes = []
+
+    def write(self, data: bytes):
+        self.writes.append((time.perf_counter(), data))
+
+    def stats(self) -> dict:
+        return {"sent": len(self.writes)}
+
+
+class QueuedTransport(Transport, threading.Thread):
+    """Writes from a thread of its own over a connection it keeps open.
+
+    `write` only queues the line. The thread connects right away,
+    reconnects with exponential backoff whenever the peer goes away, and
+    meanwhile keeps the newest MAX_PENDING_WRITES lines. Subclasses open
+    the connection in `_connect` and send one batch of lines in `_send`.
+    """
+
+    def __init__(self, address, on_line=None, on_connect=None) -> None:
+        threading.Thread.__init__(self, daemon=True)
+        self.address = address
+        self.on_line = on_line
+        self.on_connect = on_connect
+        self._pending = deque(maxlen=MAX_PENDING_WRITES)
+        self._condition = threading.Condition()
+        self._running = True
+        self.connected = False
+        self.sent = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.start()
+
+    def write(self, data: bytes):
+        with self._condition:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(data)
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self.join(RECONNECT_MAX_S)
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+        }
+
+    def _connect(self):
+        raise NotImplementedError
+
+    def _send(self, connection, lines: list):
+        raise NotImplementedError
+
+    def _disconnect(self, connection):
+        connection.close()
+
+    def _sleep(self, timeout_s):
+        """Waits out a backoff, returns False once closed."""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._running, timeout_s)
+            return self._running
+
+    def run(self) -> None:
+        connection = None
+        backoff_s = RECONNECT_MIN_S
+        while self._running:
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except Exception as e:
+                    if backoff_s == RECONNECT_MIN_S:
+                        print(f"{self.address} unreachable, retrying -", e)
+                    self._sleep(backoff_s)
+                    backoff_s = min(backoff_s * 2, RECONNECT_MAX_S)
+                    continue
+                self.connected = True
+                backoff_s = RECONNECT_MIN_S
+                self._connected(connection)
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                lines = list(self._pending)
+                self._pending.clear()
+            if not lines:
+                break
+            try:
+                self._send(connection, lines)
+                self.sent += len(lines)
+            except Exception as e:
+                print(f"{self.address} lost, reconnecting -", e)
+                self.dropped += len(lines)
+                self._close_quietly(connection)
+                connection = None
+                self.connected = False
+                self.reconnects += 1
+        if connection is not None:
+            self._close_quietly(connection)
+        self.connected = False
+
+    def _close_quietly(self, connection):
+        try:
+            self._disconnect(connection)
+        except Exception:
+            pass
+
+
+class SerialTransport(Transport):
+    """Writes on the caller's thread, pyserial's write_timeout bounds how long that takes.
+
+    A port that fails is closed, the lines meanwhile are dropped and later
+    writes reopen it, at most once per backoff.
+    """
+
+    def __init__(self, port, baudrate, on_line=None, on_connect=None) -> None:
+        self.address = port
+        self.baudrate = baudrate
+        self.on_line = on_line
+        self.on_connect = on_connect
+        self._channel = None
+        self._retry_at = 0
+        self._backoff_s = RECONNECT_MIN_S
+        self.connected = False
+        self.sent = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self._open()
+
+    def _open(self) -> bool:
+        try:
+            channel = serial.serial_for_url(
+                self.address,
+                self.baudrate,
+                timeout=READ_TIMEOUT_S,
+                write_timeout=WRITE_TIMEOUT_S,
+            )
+            channel.reset_input_buffer()
+        except Exception as e:
+            if self._backoff_s == RECONNECT_MIN_S:
+                print(f"{self.address} unreachable, retrying -", e)
+            self._retry_at = time.perf_counter() + self._backoff_s
+            self._backoff_s = min(self._backoff_s * 2, RECONNECT_MAX_S)
+            return False
+        self._channel = channel
+        self._backoff_s = RECONNECT_MIN_S
+        self.connected = True
+        self._connected(channel)
+        return True
+
+    def write(self, data: bytes):
+        if self._channel is None and (time.perf_counter() < self._retry_at or not self._open()):
+            self.dropped += 1
+            return
+        try:
+            self._channel.write(data)
+            self.sent += 1
+        except Exception as e:
+            print(f"{self.address} lost, reopening -", e)
+            self.dropped += 1
+            self._close_channel()
+            self.reconnects += 1
+
+    def _close_channel(self):
+        channel, self._channel = self._channel, None
+        self.connected = False
+        try:
+            channel.close()
+        except Exception:
+            pass
+
+    def close(self):
+        self._running = False
+        if self._channel is not None:
+            self._close_channel()
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+        }
+
+    def _receive(self, channel):
+        # reading and writing from two threads is fine with pyserial
+        return channel.read(channel.in_waiting or 1) or None
+
+
+class TcpTransport(QueuedTransport):
+    def _connect(self):
+        parts = urlsplit(self.address)
+        connection = socket.create_connection((parts.hostname, parts.port), CONNECT_TIMEOUT_S)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection.settimeout(WRITE_TIMEOUT_S)
+        return connection
+
+    def _send(self, connection, lines):
+        connection.sendall(b"".join(lines))
+
+    def _receive(self, connection):
+        try:
+            return connection.recv(RECEIVE_BYTES)
+        except socket.timeout:
+            return None
+
+
+class UdpTransport(QueuedTransport):
+    def _connect(self):
+        parts = urlsplit(self.address)
+        family, kind, protocol, _, address = socket.getaddrinfo(
+            parts.hostname, parts.port, type=socket.SOCK_DGRAM
+        )[0]
+        connection = socket.socket(family, kind, protocol)
+        connection.settimeout(READ_TIMEOUT_S)
+        connection.connect(address)
+        return connection
+
+    def _send(self, connection, lines):
+        for line in lines:
+            connection.send(line)
+
+    def _receive(self, connection):
+        try:
+            return connection.recv(RECEIVE_BYTES)
+        # nobody listening (yet) is no reason to stop, the device may answer later
+        except (socket.timeout, ConnectionRefusedError):
+            return None
+
+
+class WebSocketTransport(QueuedTransport):
+    """One text message per line, the way MultiFunPlayer's TCode input takes them."""
+
+    def _connect(self):
+        # wsproto comes with mitmproxy
+        from wsproto import ConnectionType, WSConnection
+        from wsproto.events import AcceptConnection, RejectConnection, Request
+
+        parts = urlsplit(self.address)
+        port = parts.port or (443 if parts.scheme == "wss" else 80)
+        connection = socket.create_connection((parts.hostname, port), CONNECT_TIMEOUT_S)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if parts.scheme == "wss":
+            connection = ssl.create_default_context().wrap_socket(
+                connection, server_hostname=parts.hostname
+            )
+        connection.settimeout(WRITE_TIMEOUT_S)
+        websocket = WSConnection(ConnectionType.CLIENT)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        connection.sendall(websocket.send(Request(host=parts.netloc, target=target)))
+        while True:
+            data = connection.recv(RECEIVE_BYTES)
+            if not data:
+                raise ConnectionError("closed during the handshake")
+            websocket.receive_data(data)
+            for event in websocket.events():
+                if isinstance(event, AcceptConnection):
+                    # wsproto is not thread safe, the reader and the writer take turns
+                    return connection, websocket, threading.Lock()
+                if isinstance(event, RejectConnection):
+                    raise ConnectionError(f"handshake rejected with {event.status_code}")
+
+    def _receive_events(self, connection, websocket) -> bytes:
+        """Reads what is waiting, answers pings and returns the text messages as lines."""
+        from wsproto.events import CloseConnection, Message, Ping
+
+        data = connection.recv(RECEIVE_BYTES)
+        if not data:
+            raise ConnectionError("closed by the peer")
+        websocket.receive_data(data)
+        lines = b""
+        for event in websocket.events():
+            if isinstance(event, Ping):
+                connection.sendall(websocket.send(event.response()))
+            elif isinstance(event, CloseConnection):
+                raise ConnectionError("closed by the peer")
+            elif isinstance(event, Message):
+                message = event.data.encode() if isinstance(event.data, str) else event.data
+                lines += message.rstrip(b"\n") + b"\n"
+        return lines
+
+    def _send(self, connection, lines):
+        from wsproto.events import TextMessage
+
+        connection, websocket, lock = connection
+        with lock:
+            # without a reader, answer pings and notice a close without ever waiting for the peer
+            while self.on_line is None and select.select([connection], [], [], 0)[0]:
+                self._receive_events(connection, websocket)
+            connection.sendall(
+                b"".join(websocket.send(TextMessage(data=line.decode())) for line in lines)
+            )
+
+    def _receive(self, connection):
+        connection, websocket, lock = connection
+        if not select.select([connection], [], [], READ_TIMEOUT_S)[0]:
+            return None
+        with lock:
+            try:
+                return self._receive_events(connection, websocket) or None
+            except ConnectionError:
+                return b""
+
+    def _disconnect(self, connection):
+        connection[0].close()
+
+
+TRANSPORTS = {
+    "tcp": TcpTransport,
+    "udp": UdpTransport,
+    "ws": WebSocketTransport,
+    "wss": WebSocketTransport,
+}
+
+
+def open_transport(
+    address, baudrate=None, debug=False, on_line=None, on_connect=None
+) -> Transport:
+    """The transport for a configured port, `debug` prints serial lines instead.
+
+    `on_line` gets the lines the device sends back and `on_connect` the
+    transport once it (re)connected, capture and print transports never
+    call either.
+    """
+    scheme = address.partition("://")[0] if "://" in address else ""
+    if scheme in TRANSPORTS:
+        return TRANSPORTS[scheme](address, on_line, on_connect)
+    if scheme == "capture":
+        return CaptureTransport()
+    if scheme == "print" or debug:
+        return PrintTransport()
+    return SerialTransport(address, baudrate, on_line, on_connect)
@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import patterns as patterns_module
+
+WARMUP_BLOCKS = 2
+# how often a paused warm-up checks whether the device is idle again
+IDLE_POLL_S = 0.2
+
+
+def _lower_priority():
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+
+def render_blocks(name, parameters, blocks):
+    """Runs in a worker process, see `patterns.prerender_blocks`."""
+    return patterns_module.prerender_blocks(name, parameters, blocks)
+
+
+class Warmup(threading.Thread):
+    """Fills a BlockCache for likely states in a pool of worker processes.
+
+    `tasks` are `(pattern name, quantized parameters)` pairs. New tasks are
+    only handed out while `is_idle()` is true, so live renders do not
+    compete with the warm-up, and the workers run at a lower priority.
+    """
+
+    def __init__(self, cache, tasks, is_idle, workers=None, blocks=WARMUP_BLOCKS) -> None:
+        super().__init__(daemon=True)
+        self._cache = cache
+        self._tasks = list(tasks)
+        self._is_idle = is_idle
+        self._workers = workers or os.cpu_count() or 1
+        self._blocks = blocks
+        self.rendered = 0
+
+    def _collect(self, futures):
+        for future in futures:
+            try:
+                for key, block in future.result():
+                    self._cache.put(key, block)
+            except Exception as e:
+                print("warm-up failed -", e)
+                continue
+            self.rendered += 1
+
+    def run(self) -> None:
+        started_at = time.perf_counter()
+        # spawn, forking the proxy with its threads running is not safe
+        with ProcessPoolExecutor(
+            self._workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_lower_priority,
+        ) as pool:
+            pending = set()
+            for task in self._tasks:
+                while not self._is_idle():
+                    time.sleep(IDLE_POLL_S)
+                if len(pending) >= self._workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(done)
+                pending.add(pool.submit(render_blocks, *task, self._blocks))
+            self._collect(wait(pending).done)
+        print(
+            f"warm-up rendered {self.rendered} states in "
+            f"{time.perf_counter() - started_at:.1f}s"
+        )
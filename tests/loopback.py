@@ -0,0 +1,115 @@
+"""A stand-in for the tcp, udp and ws peers a transport talks to."""
+import socket
+import threading
+
+from transports import RECEIVE_BYTES
+
+
+class LoopbackPeer:
+    """Receives what a transport sends on 127.0.0.1, collected in `received`.
+
+    For the stream and datagram schemes each item is one `recv`, for ws
+    it is one message. `respond(data)` may return bytes to answer with,
+    the way a device answers D0, D1 and D2.
+    """
+
+    def __init__(self, scheme, respond=None) -> None:
+        self.scheme = scheme
+        self.received = []
+        self._respond = respond
+        self._sockets = []
+        kind = socket.SOCK_DGRAM if scheme == "udp" else socket.SOCK_STREAM
+        self._listener = socket.socket(socket.AF_INET, kind)
+        self._listener.bind(("127.0.0.1", 0))
+        host, port = self._listener.getsockname()
+        self.address = f"{scheme}://{host}:{port}"
+        if scheme != "udp":
+            self._listener.listen()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        if self.scheme == "udp":
+            self._receive_datagrams()
+            return
+        while True:
+            try:
+                connection, _ = self._listener.accept()
+            except OSError:  # closed
+                return
+            self._sockets.append(connection)
+            threading.Thread(target=self._receive, args=(connection,), daemon=True).start()
+
+    def _reply(self, data):
+        return self._respond(data) if self._respond is not None else None
+
+    def _receive_datagrams(self):
+        while True:
+            try:
+                data, address = self._listener.recvfrom(RECEIVE_BYTES)
+            except OSError:
+                return
+            self.received.append(data)
+            reply = self._reply(data)
+            if reply:
+                self._listener.sendto(reply, address)
+
+    def _receive(self, connection):
+        websocket = None
+        if self.scheme == "ws":
+            from wsproto import ConnectionType, WSConnection
+
+            websocket = WSConnection(ConnectionType.SERVER)
+        while True:
+            try:
+                data = connection.recv(RECEIVE_BYTES)
+            except OSError:
+                return
+            if not data:
+                return
+            self._answer(connection, websocket, data)
+
+    def _answer(self, connection, websocket, data):
+        try:
+            if websocket is not None:
+                self._receive_websocket(connection, websocket, data)
+                return
+            self.received.append(data)
+            reply = self._reply(data)
+            if reply:
+                connection.sendall(reply)
+        except OSError:  # dropped meanwhile
+            pass
+
+    def _receive_websocket(self, connection, websocket, data):
+        from wsproto.events import AcceptConnection, Request, TextMessage
+
+        websocket.receive_data(data)
+        for event in websocket.events():
+            if isinstance(event, Request):
+                connection.sendall(websocket.send(AcceptConnection()))
+            elif isinstance(event, TextMessage):
+                message = event.data.encode()
+                self.received.append(message)
+                reply = self._reply(message)
+                for line in (reply or b"").splitlines():
+                    connection.sendall(websocket.send(TextMessage(data=line.decode())))
+
+    def drop_connections(self):
+        """Closes the accepted connections, the transport has to reconnect."""
+        for connection in self._sockets:
+            # a close alone leaves the receiving thread reading on
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            connection.close()
+        self._sockets = []
+
+    def close(self):
+        self.drop_connections()
+        # a close alone leaves accept() (or recvfrom) waiting on Linux
+        try:
+            self._listener.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._listener.close()
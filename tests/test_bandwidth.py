@@ -0,0 +1,37 @@
+import pytest
+
+from bandwidth import LinkBudget
+
+
+def test_the_fill_drains_at_the_links_byte_rate():
+    # 8N1, 10 bits per byte: 1000 bytes a second
+    budget = LinkBudget(10_000, budget_ms=20)
+    assert budget.bytes_per_s == 1000
+    assert budget.max_fill_bytes == pytest.approx(20)
+    assert budget.fill_at(5.0) == 0
+    budget.written(100, 5.0)
+    assert budget.fill_at(5.0) == pytest.approx(100)
+    assert budget.fill_at(5.05) == pytest.approx(50)
+    assert budget.fill_at(5.2) == 0
+    # what is still on its way adds up
+    budget.written(30, 5.05)
+    assert budget.fill_at(5.05) == pytest.approx(80)
+
+
+def test_fits_counts_what_drains_until_the_next_write():
+    budget = LinkBudget(10_000, budget_ms=20)
+    budget.written(50, 0.0)
+    # 50 + 10 bytes, 40 of them gone 40 ms later: 20 left, just within budget
+    assert budget.fits(10, 0.04, 0.0)
+    assert not budget.fits(11, 0.04, 0.0)
+    # later on, more of the fill has drained
+    assert budget.fits(11, 0.04, 0.01)
+
+
+def test_a_write_onto_a_full_link_is_over_budget():
+    budget = LinkBudget(10_000, budget_ms=20)
+    budget.written(30, 0.0)
+    assert budget.over_budget == 0
+    budget.written(10, 0.001)
+    assert budget.over_budget == 1
+    assert budget.peak_fill_bytes == pytest.approx(39)
@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+from coalescer import Coalescer
+from test_transports import wait_for
+
+
+class Applied:
+    def __init__(self) -> None:
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, keys, context):
+        with self._lock:
+            self.calls.append((keys, context))
+
+
+@pytest.fixture
+def applied():
+    return Applied()
+
+
+@pytest.fixture
+def coalescer(applied):
+    coalescer = Coalescer(applied, window_ms=50)
+    coalescer.start()
+    yield coalescer
+    coalescer.stop_thread()
+    coalescer.join(1)
+
+
+def test_an_update_after_a_quiet_window_is_applied_right_away(coalescer, applied):
+    coalescer.submit("speed", "first")
+    # on the caller's thread, before submit returns
+    assert applied.calls == [({"speed"}, "first")]
+
+
+def test_updates_within_the_window_are_merged(coalescer, applied):
+    coalescer.submit("speed", 1)
+    coalescer.submit("stroke", 2)
+    coalescer.submit("speed", 3)
+    assert len(applied.calls) == 1
+    assert wait_for(lambda: len(applied.calls) == 2)
+    # every key once, with the latest context
+    assert applied.calls[1] == ({"stroke", "speed"}, 3)
+    assert coalescer.stats() == {"submitted": 3, "applied": 2, "saved": 1}
+
+
+def test_apply_now_takes_the_pending_updates_along(coalescer, applied):
+    coalescer.submit("speed", 1)
+    coalescer.submit("stroke", 2)
+    coalescer.apply_now("mode", 3)
+    assert applied.calls == [({"speed"}, 1), ({"stroke", "mode"}, 3)]
+    # nothing is left for the end of the window
+    assert not wait_for(lambda: len(applied.calls) > 2, timeout_s=0.15)
+
+
+def test_a_burst_is_applied_once_per_window(coalescer, applied):
+    for i in range(80):
+        coalescer.submit(("speed", "stroke")[i % 2], i)
+    assert wait_for(lambda: applied.calls[-1][1] == 79)
+    # the first update right away, the other 79 at the end of the window
+    assert len(applied.calls) <= 3
+    stats = coalescer.stats()
+    assert stats["submitted"] == 80
+    assert stats["saved"] == 80 - len(applied.calls) >= 77
@@ -0,0 +1,65 @@
+from encoding import DeltaEncoder, RangeMap, configured_axes, merge_ranges
+from tcode_fire import TcodeInstruction, TcodeLine
+
+
+def line_of(*commands, duration_ms=None):
+    return TcodeLine([TcodeInstruction(*command) for command in commands], duration_ms)
+
+
+def test_repeated_targets_are_left_out():
+    encoder = DeltaEncoder()
+    assert encoder.encode(line_of(("L0", 50, 100), ("R0", 20, 100))) == b"L050I100 R020I100\n"
+    assert encoder.encode(line_of(("L0", 60, 100), ("R0", 20, 100))) == b"L060I100\n"
+    assert encoder.encode(line_of(("L0", 60, 100), ("R0", 20, 100))) == b""
+    assert encoder.dropped == 3
+
+
+def test_a_target_still_on_its_way_is_resent_if_wanted_sooner():
+    encoder = DeltaEncoder()
+    encoder.encode(line_of(("L0", 50, 500), duration_ms=100))
+    assert encoder.encode(line_of(("L0", 50, 100))) == b"L050I100\n"
+
+
+def test_reset_sends_everything_again():
+    encoder = DeltaEncoder()
+    line = line_of(("L0", 50, 100))
+    encoder.encode(line)
+    encoder.reset()
+    assert encoder.encode(line) == b"L050I100\n"
+
+
+def test_axes_left_out_are_never_sent():
+    encoder = DeltaEncoder({"L0"})
+    assert encoder.encode(line_of(("L0", 50, 100), ("R0", 20, 100))) == b"L050I100\n"
+
+
+def test_device_ranges_merge_axis_by_axis():
+    ranges = {"stroke": {"min": 0, "max": 99}, "twist": {"min": 20, "max": 80}}
+    merged = merge_ranges(ranges, {"twist": {"enabled": False}, "stroke": {"max": 49}})
+    assert merged == {
+        "stroke": {"min": 0, "max": 49},
+        "twist": {"min": 20, "max": 80, "enabled": False},
+    }
+    assert configured_axes(merged) == {"L0"}
+    assert ranges["stroke"] == {"min": 0, "max": 99}
+
+
+def test_range_map_moves_positions_into_the_device_range():
+    ranges = {"stroke": {"min": 0, "max": 99}, "twist": {"min": 0, "max": 99}}
+    range_map = RangeMap(ranges, merge_ranges(ranges, {"stroke": {"min": 20, "max": 80}}))
+    line = line_of(("L0", 0, 100), ("L0", 99, 100), ("R0", 50, 100))
+    assert [i.value for i in range_map.remap(line).instructions] == [20, 80, 50]
+
+
+def test_range_map_skips_axes_without_a_range():
+    range_map = RangeMap({"twist": {"min": 0, "max": 99}}, {"twist": {"enabled": False}})
+    line = line_of(("R0", 50, 100))
+    assert range_map.remap(line) is line
+
+
+def test_encoded_lines_are_not_parsed():
+    encoder = DeltaEncoder({"L0", "R0"})
+    encoder.encode(TcodeLine.from_encoded(b"L050I100 R020I100 A010I100\n", 100))
+    line = TcodeLine.from_encoded(b"L060I100 R020I100 A010I100\n", 100)
+    assert encoder.encode(line) == b"L060I100\n"
+    assert line._instructions is None
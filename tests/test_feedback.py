@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from feedback import DeviceFeedback
+from loopback import LoopbackPeer
+from tcode_fire import TcodeFire, TcodeInstruction, TcodeLine
+from test_transports import wait_for
+
+RTT_S = 0.01
+
+
+def device(data):
+    """Answers the way TCode firmware does, D1 after RTT_S."""
+    answer = b""
+    for line in data.splitlines():
+        if line == b"D0":
+            answer += b"OSR2 test firmware\n"
+        elif line == b"D1":
+            time.sleep(RTT_S)
+            answer += b"TCode v0.3\n"
+        elif line == b"D2":
+            answer += b"L0 0 9999 Up\r\nR0 0 9999 Twist\r\n"
+    return answer
+
+
+def test_parses_what_the_device_says():
+    feedback = DeviceFeedback()
+    feedback.identify(type("Sink", (), {"write": lambda self, data: None})())
+    for line in (b"OSR2 test firmware", b"TCode v0.3", b"L0 0 9999 Up", b"ok", b"L05000 R0999", b"?"):
+        feedback.receive(line, time.perf_counter())
+    stats = feedback.stats()
+    assert stats["device"] == "OSR2 test firmware"
+    assert stats["version"] == "TCode v0.3"
+    assert stats["axes"] == ["L0"]
+    assert stats["acks"] == 1
+    assert stats["positions"] == {"L0": 50.0, "R0": 99.9}
+    assert (stats["other"], stats["last_message"]) == (1, "?")
+    assert stats["lead_ms"] == 0
+
+
+@pytest.fixture
+def played():
+    peer = LoopbackPeer("tcp", respond=device)
+    feedback = DeviceFeedback(probe_interval_s=0.05)
+    fire = TcodeFire(peer.address, 115200, feedback=feedback)
+    fire.start_thread()
+    for value in range(60):
+        fire.push_instruction(TcodeLine([TcodeInstruction("L0", value, 20)]))
+    yield peer, feedback, fire
+    fire.stop_thread()
+    peer.close()
+
+
+def test_d1_round_trip_sets_the_lead(played):
+    peer, feedback, fire = played
+    assert wait_for(lambda: feedback.probes >= 3 and feedback.rtt_ms is not None)
+    stats = feedback.stats()
+    assert stats["device"] == "OSR2 test firmware"
+    assert stats["axes"] == ["L0", "R0"]
+    assert stats["rtt_ms"]["min"] == pytest.approx(RTT_S * 1000, abs=5)
+    assert feedback.lead_ms == pytest.approx(stats["rtt_ms"]["smoothed"] / 2)
+    assert wait_for(lambda: fire.lead_ms == pytest.approx(feedback.lead_ms))
+
+
+def test_identifies_again_after_a_reconnect(played):
+    peer, feedback, fire = played
+    assert wait_for(lambda: feedback.device is not None)
+    feedback.device = None
+    peer.drop_connections()
+    assert wait_for(lambda: feedback.device == "OSR2 test firmware")
+    assert b"".join(peer.received).count(b"D0\n") == 2
@@ -0,0 +1,48 @@
+import pytest
+
+from handy_api import ACTIONS, PREFLIGHT_METHODS, HandyRequest, dispatch
+
+
+class RecordingSession:
+    """Stands in for a HandySession, every call that reaches it is kept."""
+
+    def __init__(self) -> None:
+        self.state = {"stroke": {"top": 100, "bottom": 0}, "speed": 0, "mode": "halting"}
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name, *args))
+
+
+def dispatched(method, path, content=b""):
+    session = RecordingSession()
+    handled = dispatch(session, HandyRequest(method, path, content))
+    return handled, session.calls
+
+
+@pytest.mark.parametrize("method", PREFLIGHT_METHODS)
+@pytest.mark.parametrize("action", sorted(ACTIONS))
+def test_a_preflight_never_reaches_a_handler(method, action):
+    handled, calls = dispatched(method, f"/api/handy/v2/{action}?mode=1", b'{"max": 50}')
+    # answered, but nothing is applied
+    assert handled
+    assert calls == []
+
+
+@pytest.mark.parametrize("action", ["slide", "velocity", "play", "synctime"])
+def test_a_get_on_a_write_only_action_is_ignored(action):
+    assert dispatched("GET", f"/api/handy/v2/{action}") == (False, [])
+
+
+def test_a_put_on_slide_sets_the_stroke():
+    handled, calls = dispatched("PUT", "/api/handy/v2/slide", b'{"min": 20, "max": 80}')
+    assert handled
+    assert calls == [("set_state", "stroke", 80)]
+
+
+def test_a_v1_call_carries_its_key_in_the_path():
+    request = HandyRequest("GET", "/api/v1/k2/setSpeed?speed=40", b"")
+    assert (request.connection_key, request.action) == ("k2", "setSpeed")
+    session = RecordingSession()
+    assert dispatch(session, request)
+    assert session.calls == [("set_state", "speed", 40)]
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+from handy_server import MAX_BODY_BYTES, read_body
+
+
+def body_of(data: bytes, headers):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        body = await read_body(reader, headers)
+        return body, await reader.read()
+
+    return asyncio.run(read())
+
+
+def test_reads_the_content_length():
+    assert body_of(b'{"a": 1}GET', {"content-length": "8"}) == (b'{"a": 1}', b"GET")
+    assert body_of(b"GET", {}) == (b"", b"GET")
+
+
+def test_decodes_a_chunked_body():
+    data = b'3\r\n{"a\r\n5;ext=1\r\n": 1}\r\n0\r\nExpires: 0\r\n\r\nGET'
+    # the next request on the connection is left where it was
+    assert body_of(data, {"transfer-encoding": "chunked"}) == (b'{"a": 1}', b"GET")
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"x\r\n",  # not a size
+        b"3\r\nabcX\r\n0\r\n\r\n",  # no line end after the chunk
+        b"%x\r\n" % (MAX_BODY_BYTES + 1),
+    ],
+)
+def test_rejects_a_malformed_chunked_body(data):
+    with pytest.raises(ValueError):
+        body_of(data, {"transfer-encoding": "chunked"})
+
+
+def test_a_body_cut_short_is_an_incomplete_read():
+    with pytest.raises(asyncio.IncompleteReadError):
+        body_of(b"3\r\nab", {"transfer-encoding": "chunked"})
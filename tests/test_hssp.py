@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from hssp import Script, ScriptCache, content_hash, serve_scripts
+
+FUNSCRIPT = json.dumps(
+    {
+        "version": "1.0",
+        "inverted": False,
+        "actions": [
+            {"at": 1000, "pos": 100},
+            {"pos": 0, "at": 500},
+            {"at": 0, "pos": 50},
+            {"at": 1500, "pos": 20},
+            {"at": 1500, "pos": 30},
+            {"at": 2000, "pos": 150},
+        ],
+    }
+).encode()
+
+
+def test_parse_sorts_dedupes_and_clips():
+    script = Script.parse(FUNSCRIPT)
+    assert list(script.times) == [0, 500, 1000, 1500, 2000]
+    # the later of two actions at the same time wins, positions stay within 0-100
+    assert list(script.positions) == [50, 0, 100, 30, 100]
+    assert script.duration_ms == 2000
+
+
+def test_parse_skips_other_fields_and_reads_any_number():
+    content = (
+        b'{"actions": [{"at": 1.5e2, "pos": 40, "selected": true, "note": "x-1e2 {"}, '
+        b'{"pos": 100, "id": -7, "at": 300}, {"at": 400}]}'
+    )
+    script = Script.parse(content)
+    # an action without a position is left out
+    assert (list(script.times), list(script.positions)) == ([150, 300], [40, 100])
+
+
+def test_parse_inverted():
+    script = Script.parse(FUNSCRIPT.replace(b'"inverted": false', b'"inverted": true'))
+    assert list(script.positions) == [50, 100, 0, 70, 0]
+
+
+def test_parse_rejects_what_is_not_a_funscript():
+    with pytest.raises(ValueError):
+        Script.parse(b'{"version": "1.0"}')
+
+
+def test_read_what_was_written(tmp_path):
+    script = Script.parse(FUNSCRIPT)
+    script.write(tmp_path / "a.script")
+    read = Script.read(tmp_path / "a.script")
+    assert (read.times, read.positions) == (script.times, script.positions)
+
+
+def test_lines_seek_into_the_script():
+    script = Script.parse(FUNSCRIPT)
+    assert script.index_at(700) == 2
+    lines = script.lines(700, bottom=0, top=100)
+    first = next(lines).instructions[0]
+    # the move to the next action takes what is left of its interval
+    assert (first.axis, first.duration_ms) == ("L0", 300)
+    assert next(lines).instructions[0].duration_ms == 500
+
+
+@pytest.fixture
+def served(tmp_path):
+    (tmp_path / "served").mkdir()
+    (tmp_path / "served" / "video.funscript").write_bytes(FUNSCRIPT)
+    server = serve_scripts(str(tmp_path / "served"))
+    host, port = server.server_address
+    yield f"http://{host}:{port}/video.funscript"
+    server.shutdown()
+    server.server_close()
+
+
+def test_setup_then_cache_hit_then_seek(tmp_path, served):
+    cache = ScriptCache(str(tmp_path / "cache"))
+    script = cache.load(served)
+    assert (cache.downloads, cache.parses) == (1, 1)
+
+    # the same URL again, and from a fresh cache on the same directory: neither downloads
+    assert list(cache.load(served).times) == list(script.times)
+    fresh = ScriptCache(str(tmp_path / "cache"))
+    again = fresh.load(served)
+    assert (cache.downloads, fresh.downloads, fresh.parses) == (1, 0, 0)
+
+    first = next(again.lines(1200)).instructions[0]
+    assert first.duration_ms == 300
+
+
+def test_a_known_sha256_skips_the_download(tmp_path, served):
+    cache = ScriptCache(str(tmp_path / "cache"))
+    cache.load(served)
+    other = ScriptCache(str(tmp_path / "cache"), fetch=lambda url: pytest.fail("downloaded"))
+    other.load("http://elsewhere/video.funscript", content_hash(FUNSCRIPT).upper())
+    assert other.downloads == 0
+
+
+@pytest.mark.parametrize("sha256", ["../../x", "0" * 63, 12345])
+def test_a_malformed_sha256_is_ignored(tmp_path, served, sha256):
+    cache = ScriptCache(str(tmp_path / "cache"))
+    assert len(cache.load(served, sha256)) == 5
+    assert cache.downloads == 1
@@ -0,0 +1,58 @@
+from keyframes import compress_keyframes
+from tcode_fire import TcodeInstruction, TcodeLine
+
+
+def lines_of(*values, step_ms=10, axis="L0"):
+    return [TcodeLine([TcodeInstruction(axis, value, step_ms)]) for value in values]
+
+
+def test_a_straight_ramp_becomes_one_move():
+    lines = lines_of(*range(0, 100, 10), 80, 70)
+    assert [str(line).strip() for line in compress_keyframes(lines)] == [
+        "L000I10",
+        "L090I90",
+        "L070I20",
+    ]
+
+
+def test_the_ramp_a_finite_input_ends_on_is_sent():
+    lines = lines_of(50, 50, 37, 43, 49, 55)
+    compressed = list(compress_keyframes(lines))
+    assert str(compressed[-1]).strip() == "L055I30"
+    # and the input's timeline is kept to its end
+    assert sum(line.duration_ms for line in compressed) == 60
+
+
+def test_turning_points_are_kept():
+    lines = lines_of(0, 50, 99, 50, 0, 50, 99, 50)
+    values = [line.instructions[0].value for line in compress_keyframes(lines)]
+    assert values[:3] == [0, 99, 0]
+
+
+def test_keyframes_keep_the_timeline():
+    lines = lines_of(0, 50, 99, 50, 0, 50, 99, 50, 0, 50)
+    compressed = list(compress_keyframes(lines))
+    issued_ms = [0]
+    for line in compressed:
+        issued_ms.append(issued_ms[-1] + line.duration_ms)
+    # each move leaves when its samples would have, the last one when the input ends
+    assert issued_ms == [0, 10, 30, 50, 70, 90, 100]
+    assert [line.instructions[0].duration_ms for line in compressed] == [10, 20, 20, 20, 20, 10]
+
+
+def test_a_path_that_bends_more_than_the_tolerance_is_split():
+    lines = lines_of(0, 10, 30, 60, 99, 0)
+    assert len(list(compress_keyframes(lines, tolerance=1))) > len(
+        list(compress_keyframes(lines, tolerance=20))
+    )
+
+
+def test_a_jump_followed_by_a_move_in_the_same_instant_is_one_command():
+    # a script started right on one of its actions begins with a 0 ms move
+    lines = [TcodeLine([TcodeInstruction("L0", 7, 0)])] + lines_of(68, step_ms=100)
+    assert [str(line).strip() for line in compress_keyframes(lines)] == ["L068I100"]
+
+
+def test_a_jump_on_its_own_is_kept():
+    lines = [TcodeLine([TcodeInstruction("L0", 7, 0)], 50)] + lines_of(68, step_ms=100)
+    assert [str(line).strip() for line in compress_keyframes(lines)] == ["L007I0", "L068I100"]
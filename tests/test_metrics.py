@@ -0,0 +1,47 @@
+import time
+
+from metrics import LatencyMetrics, MetricsWriter, read_metrics
+
+
+def test_first_writes_of_sessions_do_not_overwrite_each_other():
+    metrics = LatencyMetrics()
+    metrics.expect_first_write("default", 1, "slide", 0.0, 0.001)
+    metrics.expect_first_write("k2", 1, "velocity", 0.0, 0.001)
+    metrics.first_write("k2", 1, 0.002)
+    metrics.first_write("default", 1, 0.003)
+    # a later line of the same generation is not a first write
+    metrics.first_write("default", 1, 0.5)
+    snapshot = metrics.snapshot()
+    assert snapshot["slide"]["first_byte"]["count"] == 1
+    assert snapshot["slide"]["first_byte"]["max_ms"] < 5
+    assert snapshot["velocity"]["first_byte"]["count"] == 1
+
+
+def test_first_write_of_another_generation_is_ignored():
+    metrics = LatencyMetrics()
+    metrics.expect_first_write("default", 2, "slide", 0.0, 0.001)
+    metrics.first_write("default", 1, 0.002)
+    assert metrics.snapshot() == {}
+
+
+def test_writer_keeps_going_after_a_failed_snapshot(tmp_path):
+    failures = []
+
+    def extra():
+        if not failures:
+            failures.append(True)
+            raise RuntimeError("dictionary changed size during iteration")
+        return {"ok": True}
+
+    path = str(tmp_path / "metrics.json")
+    writer = MetricsWriter(LatencyMetrics(), path, interval_s=0.01, extra=extra)
+    writer.start()
+    try:
+        deadline = time.perf_counter() + 2
+        while read_metrics(path).get("ok") is not True and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        assert read_metrics(path)["ok"] is True
+    finally:
+        writer.stop()
+        writer.join(1)
+    assert not writer.is_alive()
@@ -0,0 +1,98 @@
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+import patterns
+from patterns import (
+    INIT_TIME_DURATION_MS,
+    STEP_SIZE_MS,
+    CycleAxis,
+    OrbitalAxis,
+    full_stroke_with_pitch_motion_axes,
+    full_stroke_with_roll_motion_axes,
+    get_orbital_position,
+    render_block,
+)
+from tcode_fire import TcodeInstruction, TcodeLine
+
+
+def scalar_line(axes, step, step_size_ms=STEP_SIZE_MS):
+    """A step rendered one value at a time, the way the generators did before blocks."""
+    t = (step + 1) * step_size_ms
+    duration = INIT_TIME_DURATION_MS if step == 0 else step_size_ms
+    instructions = []
+    for axis in axes:
+        if isinstance(axis, CycleAxis):
+            positions = axis._positions.tolist()
+            value = positions[(step + axis._offset) % len(positions)]
+        else:
+            value = get_orbital_position(
+                axis._angle(t), axis._top_limit, axis._bottom_limit, axis._phase, axis._ecc
+            )
+        instructions.append(TcodeInstruction(axis.axis, value, duration))
+    return TcodeLine(instructions).encode()
+
+
+def block_lines(axes, start, count):
+    block = render_block(axes, start, count).to_tcode_block()
+    return [block.encoded(i) for i in range(count)]
+
+
+@pytest.mark.parametrize(
+    "build_axes", [full_stroke_with_roll_motion_axes, full_stroke_with_pitch_motion_axes]
+)
+@pytest.mark.parametrize(
+    "top, bottom, back, forth, speed",
+    [
+        (100, 0, 0, 100, 0.5),
+        (80, 20, 30, 70, 0.1),
+        (60, 55, 100, 0, 1.7),
+        (100, 95, 50, 50, 0.03),
+    ],
+)
+@pytest.mark.parametrize("start", [0, 64, 10_000])
+def test_blocks_match_the_scalar_generators(build_axes, top, bottom, back, forth, speed, start):
+    axes = build_axes(top, bottom, back, forth, speed)
+    expected = [scalar_line(axes, step) for step in range(start, start + 64)]
+    assert block_lines(axes, start, 64) == expected
+
+
+def test_values_on_an_integer_are_truncated_like_the_scalar_path(monkeypatch):
+    fallbacks = []
+
+    def counted(*args):
+        fallbacks.append(args)
+        return get_orbital_position(*args)
+
+    monkeypatch.setattr(patterns, "get_orbital_position", counted)
+    # a quarter turn per step lands cos on 0, and -1/1 every other step,
+    # where numpy and libm may disagree in the last bit
+    axes = [
+        OrbitalAxis("R0", math.pi / 2 / STEP_SIZE_MS, top, bottom, phase, 0)
+        for top, bottom, phase in itertools.product((100, 99, 0), (0, 1, 100), (0, 1, -1))
+    ]
+    # and a sixth of a turn, which lands on halves of the range
+    axes.append(OrbitalAxis("R1", math.pi / 3 / STEP_SIZE_MS, 100, 0, 0, 0))
+    steps = np.arange(0, 256, dtype=np.int64)
+    for axis in axes:
+        t = (steps + 1) * STEP_SIZE_MS
+        expected = [
+            get_orbital_position(
+                axis._angle(int(step_t)), axis._top_limit, axis._bottom_limit, axis._phase, 0
+            )
+            for step_t in t
+        ]
+        assert axis.render(steps, t).tolist() == expected
+    # those values went through the scalar path
+    assert fallbacks
+
+
+def test_a_retargeted_axis_matches_the_scalar_path():
+    axes = full_stroke_with_roll_motion_axes(100, 0, 0, 100, 0.5)
+    retargeted = full_stroke_with_roll_motion_axes(90, 10, 20, 80, 0.8)
+    for axis, previous in zip(retargeted, axes):
+        axis.continue_from(previous, 100, 100 * STEP_SIZE_MS)
+    expected = [scalar_line(retargeted, step) for step in range(100, 164)]
+    assert block_lines(retargeted, 100, 64) == expected
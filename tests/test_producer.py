@@ -0,0 +1,91 @@
+import math
+
+import producer
+from patterns import (
+    INIT_TIME_DURATION_MS,
+    STEP_SIZE_MS,
+    full_stroke_with_roll_motion,
+    full_stroke_with_roll_motion_axes,
+    render_block,
+    updated_parameters,
+)
+from producer import PatternProducer
+from tcode_fire import QUEUE_SIZE, TcodeFire, TcodeInstruction, TcodeLine
+from test_transports import wait_for
+from transports import CaptureTransport
+
+
+def started(transport):
+    fire = TcodeFire("capture://", 115200, transport=transport)
+    fire.start_thread()
+    pattern_producer = PatternProducer(fire)
+    pattern_producer.start()
+    return fire, pattern_producer
+
+
+def stop(fire, pattern_producer):
+    pattern_producer.stop_thread()
+    fire.stop_thread()
+
+
+def ramp(count, step_ms):
+    for i in range(count):
+        yield TcodeLine([TcodeInstruction("L0", i % 100, step_ms)])
+
+
+def test_starts_of_played_lines_are_dropped(monkeypatch):
+    monkeypatch.setattr(producer, "TRIM_STARTS", 4)
+    transport = CaptureTransport()
+    fire, pattern_producer = started(transport)
+    try:
+        pattern_producer.set_pattern(ramp(200, 1), horizon_ms=math.inf)
+        assert wait_for(lambda: len(transport.writes) == 200)
+        # the lines queued ahead are kept, and no more than a batch of played ones
+        assert len(pattern_producer._starts) <= QUEUE_SIZE + 2 + 4
+        assert pattern_producer._start_step + len(pattern_producer._starts) == 200
+    finally:
+        stop(fire, pattern_producer)
+
+
+PARAMETERS = (100, 0, 0, 100, 0.5)
+
+
+def stream(axes, start, count):
+    block = render_block(axes, start, count).to_tcode_block()
+    return [block.encoded(i) for i in range(count)]
+
+
+def retargeted_at(step, **update):
+    axes = full_stroke_with_roll_motion_axes(*PARAMETERS)
+    retargeted = full_stroke_with_roll_motion_axes(*updated_parameters(PARAMETERS, update))
+    for axis, previous in zip(retargeted, axes):
+        axis.continue_from(previous, step, step * STEP_SIZE_MS)
+    return retargeted
+
+
+def test_send_continues_from_the_step_with_the_new_parameters():
+    lines = full_stroke_with_roll_motion(*PARAMETERS)
+    assert next(lines).duration_ms == INIT_TIME_DURATION_MS
+    line = lines.send({"step": 5, "top": 80, "speed": 0.8})
+    assert line.encode() == stream(retargeted_at(5, top=80, speed=0.8), 5, 1)[0]
+    assert line.duration_ms == STEP_SIZE_MS
+
+
+def test_retarget_continues_where_the_device_is():
+    transport = CaptureTransport()
+    fire, pattern_producer = started(transport)
+    try:
+        pattern_producer.set_pattern(full_stroke_with_roll_motion(*PARAMETERS))
+        assert wait_for(lambda: len(transport.writes) >= 3)
+        assert pattern_producer.retarget(top=80, speed=0.8)
+        assert wait_for(lambda: len(transport.writes) >= 8)
+        # the step the pattern was sent on from
+        step = pattern_producer._start_step
+    finally:
+        stop(fire, pattern_producer)
+    written = [data for _, data in transport.writes]
+    assert step >= 3
+    assert written[:step] == stream(full_stroke_with_roll_motion_axes(*PARAMETERS), 0, step)
+    after = stream(retargeted_at(step, top=80, speed=0.8), step, len(written) - step)
+    assert written[step:] == after
+    assert not any(b"I%d" % INIT_TIME_DURATION_MS in data for data in written[1:])
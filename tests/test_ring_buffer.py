@@ -0,0 +1,66 @@
+import threading
+import time
+
+from ring_buffer import RingBuffer
+
+
+def test_pops_in_order_across_the_wrap():
+    buffer = RingBuffer(3)
+    popped = []
+    for item in range(7):
+        assert buffer.push(item)
+        popped.append(buffer.pop()[1])
+    assert popped == list(range(7))
+    assert len(buffer) == 0
+
+
+def test_full_push_and_empty_pop_time_out():
+    buffer = RingBuffer(2)
+    assert buffer.push("a") and buffer.push("b")
+    assert not buffer.push("c", timeout=0.01)
+    assert buffer.pop() == (0, "a")
+    assert buffer.pop() == (0, "b")
+    assert buffer.pop(timeout=0.01) is None
+
+
+def test_peek_leaves_the_item():
+    buffer = RingBuffer(2)
+    assert buffer.peek() is None
+    buffer.push("a")
+    assert buffer.peek() == (0, "a")
+    assert len(buffer) == 1
+
+
+def test_replace_starts_a_generation_and_drops_stale_pushes():
+    buffer = RingBuffer(4)
+    buffer.push("old")
+    generation = buffer.replace(["new"])
+    assert generation == 1
+    assert not buffer.push("stale", generation=0)
+    assert buffer.push("fresh", generation=1)
+    assert [buffer.pop(), buffer.pop()] == [(1, "new"), (1, "fresh")]
+
+
+def test_replace_wakes_a_producer_blocked_on_a_full_buffer():
+    buffer = RingBuffer(1)
+    buffer.push("a")
+    results = []
+    producer = threading.Thread(target=lambda: results.append(buffer.push("b", generation=0)))
+    producer.start()
+    time.sleep(0.05)
+    buffer.replace()
+    producer.join(1)
+    assert results == [False]
+    assert len(buffer) == 0
+
+
+def test_close_wakes_a_waiting_consumer():
+    buffer = RingBuffer(1)
+    results = []
+    consumer = threading.Thread(target=lambda: results.append(buffer.pop()))
+    consumer.start()
+    time.sleep(0.05)
+    buffer.close()
+    consumer.join(1)
+    assert results == [None]
+    assert not buffer.push("a")
@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from scheduler import DeadlineScheduler, JitterStats
+
+# only a sanity bound on real sleeps, the tests share the machine with whatever else runs
+SLACK_S = 0.05
+
+def never_interrupted(timeout_s):
+    time.sleep(timeout_s)
+    return False
+
+
+def test_jitter_stats():
+    stats = JitterStats()
+    assert stats.snapshot() == {"count": 0}
+    for error_ms in (0.5, -1.5, 1.0):
+        stats.add(error_ms)
+    snapshot = stats.snapshot()
+    assert snapshot["count"] == 3
+    assert snapshot["mean_ms"] == pytest.approx(0.0)
+    assert snapshot["min_ms"] == -1.5
+    assert snapshot["max_ms"] == 1.0
+    assert snapshot["over_1ms"] == 2
+
+
+def test_deadlines_stay_on_the_absolute_grid():
+    scheduler = DeadlineScheduler()
+    scheduler.start()
+    started_at = scheduler.next_deadline
+    # on time, 3 ms late, 1 ms early, then 12 ms late
+    for k, error_s in enumerate((0, 0.003, -0.001, 0.012)):
+        assert scheduler.next_deadline == pytest.approx(started_at + k * 0.01)
+        scheduler.fired(10, scheduler.next_deadline + error_s)
+    # a late line does not push the ones after it
+    assert scheduler.next_deadline == pytest.approx(started_at + 0.04)
+    snapshot = scheduler.stats.snapshot()
+    assert snapshot["count"] == 4
+    assert snapshot["mean_ms"] == pytest.approx(3.5)
+    assert (snapshot["min_ms"], snapshot["max_ms"]) == pytest.approx((-1, 12))
+    assert snapshot["over_1ms"] == 3
+
+
+def test_errors_are_measured_against_the_arrival():
+    scheduler = DeadlineScheduler()
+    scheduler.lead_s = 0.02
+    scheduler.start()
+    due_at = scheduler.next_deadline
+    # left exactly the lead ahead of the deadline, arrives on time
+    scheduler.fired(50, due_at - 0.02)
+    scheduler.fired(50, due_at + 0.05 - 0.018)
+    snapshot = scheduler.stats.snapshot()
+    assert (snapshot["min_ms"], snapshot["max_ms"]) == pytest.approx((0, 2))
+    assert scheduler.next_deadline == pytest.approx(due_at + 0.1)
+
+
+def test_wait_returns_at_the_deadline():
+    scheduler = DeadlineScheduler()
+    scheduler.start()
+    started_at = scheduler.next_deadline
+    for _ in range(3):
+        assert scheduler.wait(never_interrupted)
+        fired_at = time.perf_counter()
+        # never early, and late only by how busy the machine is
+        assert scheduler.next_deadline <= fired_at < scheduler.next_deadline + SLACK_S
+        scheduler.fired(10, fired_at)
+    assert scheduler.next_deadline == pytest.approx(started_at + 0.03)
+
+
+def test_an_interrupted_wait_does_not_fire():
+    scheduler = DeadlineScheduler()
+    scheduler.start()
+    scheduler.fired(50, time.perf_counter())
+    assert not scheduler.wait(lambda timeout_s: True)
+
+
+def test_an_underrun_starts_a_fresh_timeline():
+    scheduler = DeadlineScheduler(resync_after_ms=10)
+    scheduler.start()
+    scheduler.fired(1, time.perf_counter())
+    time.sleep(0.03)
+    assert scheduler.wait(never_interrupted)
+    assert scheduler.resyncs == 1
+    assert scheduler.next_deadline == pytest.approx(time.perf_counter(), abs=SLACK_S)
+
+
+def test_lines_leave_ahead_by_the_lead():
+    scheduler = DeadlineScheduler()
+    scheduler.lead_s = 0.02
+    scheduler.start()
+    started_at = time.perf_counter()
+    # the first line leaves right away, the next one 20 ms before it is due
+    scheduler.fired(50, started_at)
+    assert scheduler.wait(never_interrupted)
+    leaves_at = scheduler.next_deadline - 0.02
+    assert leaves_at == pytest.approx(started_at + 0.05, abs=0.001)
+    assert leaves_at <= time.perf_counter() < leaves_at + SLACK_S
@@ -0,0 +1,119 @@
+import pytest
+
+from bandwidth import LinkBudget
+from encoding import DeltaEncoder
+from tcode_fire import TcodeFire, TcodeInstruction, TcodeLine, merge_lines, scale_line
+from test_transports import wait_for
+from transports import CaptureTransport
+
+
+def line(value, duration_ms=40, *axes):
+    return TcodeLine([TcodeInstruction(axis, value, duration_ms) for axis in axes or ("L0",)])
+
+
+@pytest.fixture
+def fire():
+    fire = TcodeFire("capture://", 115200, transport=CaptureTransport())
+    yield fire
+    fire.stop_thread()
+
+
+def test_scale_line_shortens_every_interval():
+    scaled = scale_line(
+        TcodeLine([TcodeInstruction("L0", 10, 40), TcodeInstruction("R0", 90, 25)]), 2
+    )
+    assert str(scaled).strip() == "L010I20 R090I12"
+    assert scaled.duration_ms == 20
+    assert scale_line(line(10, 40), 0.5).duration_ms == 80
+
+
+def test_set_rate_scales_the_lines_and_their_deadlines(fire, monkeypatch):
+    durations = []
+    fired = fire._scheduler.fired
+
+    def recorded(duration_ms, fired_at):
+        durations.append(duration_ms)
+        fired(duration_ms, fired_at)
+
+    monkeypatch.setattr(fire._scheduler, "fired", recorded)
+    fire.set_rate(2)
+    fire.start_thread()
+    fire.push_instructions(*(line(value) for value in (10, 20, 30, 40)))
+    assert wait_for(lambda: len(fire.transport.writes) == 4)
+    assert [data for _, data in fire.transport.writes] == [
+        b"L010I20\n",
+        b"L020I20\n",
+        b"L030I20\n",
+        b"L040I20\n",
+    ]
+    # the next deadline is half a rendered line away
+    assert durations == [20, 20, 20, 20]
+
+
+@pytest.mark.parametrize("reset", ["clear", "flush"])
+def test_clear_and_flush_play_at_the_rendered_speed_again(fire, reset):
+    fire.set_rate(1.5)
+    getattr(fire, reset)()
+    assert fire.rate == 1
+
+
+def test_merge_lines_keeps_each_axis_last_target_and_arrival():
+    lines = [
+        TcodeLine([TcodeInstruction("L0", 10, 20), TcodeInstruction("R0", 80, 50)]),
+        TcodeLine([TcodeInstruction("L0", 20, 20)]),
+        TcodeLine([TcodeInstruction("L0", 30, 20)], 20),
+    ]
+    merged = merge_lines(lines)
+    # the first line lasts its longest move, R0 is left out of the later ones
+    assert str(merged).strip() == "L030I90 R080I50"
+    assert merged.duration_ms == 90
+
+
+def test_lines_the_link_cannot_carry_are_merged_into_one_move():
+    # 100 bytes a second, 2 bytes of budget: an 8 byte line needs 60 ms of link
+    budget = LinkBudget(1000, budget_ms=20)
+    fire = TcodeFire("capture://", 115200, transport=CaptureTransport(), link_budget=budget)
+    first = line(10, 10)
+    fire.push_instructions(*(line(value, 10) for value in range(20, 100, 10)))
+    group = fire._fit_budget([first], fire._generation, 1.0)
+    assert [str(queued).strip() for queued in group] == [
+        "L010I10",
+        "L020I10",
+        "L030I10",
+        "L040I10",
+        "L050I10",
+        "L060I10",
+    ]
+    assert budget.merged_lines == 5
+    assert len(fire) == 3
+    assert str(merge_lines(group)).strip() == "L060I60"
+
+
+def test_only_lines_of_the_same_generation_are_merged():
+    budget = LinkBudget(1000, budget_ms=20)
+    fire = TcodeFire("capture://", 115200, transport=CaptureTransport(), link_budget=budget)
+    fire.push_instructions(line(20, 10), line(30, 10))
+    generation = fire._generation
+    # a flush drops the queued lines, the ones pushed after it are not part of the move
+    fire.flush()
+    fire.push_instructions(line(90, 10))
+    group = fire._fit_budget([line(10, 10)], generation, 1.0)
+    assert [str(queued).strip() for queued in group] == ["L010I10"]
+    assert len(fire) == 1
+
+
+def test_a_reconnect_sends_the_next_line_in_full():
+    fire = TcodeFire(
+        "capture://", 115200, transport=CaptureTransport(), delta_encoder=DeltaEncoder()
+    )
+    fire.start_thread()
+    try:
+        fire.push_instructions(line(50, 10), line(50, 10))
+        assert wait_for(lambda: fire.write_stats()["lines"] == 2)
+        assert len(fire.transport.writes) == 1
+        fire._on_connect(fire.transport)
+        fire.push_instructions(line(50, 10))
+        assert wait_for(lambda: len(fire.transport.writes) == 2)
+        assert [data for _, data in fire.transport.writes] == [b"L050I10\n", b"L050I10\n"]
+    finally:
+        fire.stop_thread()
@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from loopback import LoopbackPeer
+from transports import (
+    CaptureTransport,
+    PrintTransport,
+    SerialTransport,
+    TcpTransport,
+    open_transport,
+)
+
+
+def wait_for(condition, timeout_s=3):
+    deadline = time.perf_counter() + timeout_s
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def received(peer):
+    return b"".join(peer.received)
+
+
+@pytest.fixture(params=["tcp", "udp", "ws"])
+def peer(request):
+    peer = LoopbackPeer(request.param, respond=lambda data: b"ok\n" * data.count(b"\n"))
+    yield peer
+    peer.close()
+
+
+def test_sends_every_line(peer):
+    transport = open_transport(peer.address)
+    try:
+        for i in range(3):
+            transport.write(b"L0%d0I100\n" % i)
+        assert wait_for(lambda: received(peer).count(b"\n") == 3)
+        assert received(peer) == b"L000I100\nL010I100\nL020I100\n"
+        assert transport.stats()["sent"] == 3
+    finally:
+        transport.close()
+
+
+def test_reads_what_the_peer_answers(peer):
+    lines = []
+    transport = open_transport(peer.address, on_line=lambda line, at: lines.append(line))
+    try:
+        transport.write(b"D1\n")
+        assert wait_for(lambda: lines == [b"ok"])
+    finally:
+        transport.close()
+
+
+@pytest.mark.parametrize("scheme", ["tcp", "ws"])
+def test_reconnects_after_the_peer_drops(scheme):
+    peer = LoopbackPeer(scheme)
+    transport = open_transport(peer.address)
+    try:
+        transport.write(b"L050\n")
+        assert wait_for(lambda: b"L050\n" in received(peer))
+        peer.drop_connections()
+        # lines written into the dropped connection are lost until the transport notices
+        assert wait_for(lambda: transport.write(b"L060\n") or b"L060\n" in received(peer))
+        assert transport.stats()["reconnects"] >= 1
+        assert transport.stats()["connected"]
+    finally:
+        transport.close()
+        peer.close()
+
+
+def test_write_does_not_wait_for_an_unreachable_peer():
+    transport = TcpTransport("tcp://127.0.0.1:1")
+    try:
+        started_at = time.perf_counter()
+        for _ in range(100):
+            transport.write(b"L050\n")
+        assert time.perf_counter() - started_at < 0.05
+        assert not transport.stats()["connected"]
+    finally:
+        transport.close()
+
+
+def test_serial_writes_on_the_callers_thread():
+    lines = []
+    transport = SerialTransport("loop://", 115200, on_line=lambda line, at: lines.append(line))
+    try:
+        transport.write(b"L050\n")
+        # written by the time write returns, the loop port reads it back
+        assert transport.stats()["sent"] == 1
+        assert wait_for(lambda: lines == [b"L050"])
+    finally:
+        transport.close()
+
+
+def test_missing_serial_port_drops_lines():
+    transport = SerialTransport("/dev/no-such-port", 115200)
+    transport.write(b"L050\n")
+    assert transport.stats() == {"connected": False, "sent": 0, "dropped": 1, "reconnects": 0}
+
+
+def test_open_transport_by_scheme():
+    assert isinstance(open_transport("capture://"), CaptureTransport)
+    assert isinstance(open_transport("print://"), PrintTransport)
+    assert isinstance(open_transport("COM6", 115200, debug=True), PrintTransport)
+    transport = open_transport("tcp://127.0.0.1:1")
+    assert isinstance(transport, TcpTransport)
+    transport.close()